@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+
+"""Measure decoding a binary capture of JTAG dmi scans with registers.Capture.
+Unless --capture names an existing file, a random one is written first.
+
+The query finds every write to command that is followed by a read of
+abstractcs with cmderr set, which needs fields of both the dmi register and
+of abstractcs."""
+
+import argparse
+import json
+import os
+import resource
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname( os.path.dirname( os.path.abspath( __file__ ) ) )
+XML_DIR = os.path.join( ROOT, "xml" )
+sys.path.insert( 0, ROOT )
+import numpy
+import registers
+
+def write_capture( path, dmi, records, abits ):
+    """Write records random dmi scans of the main DM registers to path."""
+    codec = dmi.codec( { "abits": abits } )
+    dm = registers.load( os.path.join( XML_DIR, "dm_registers.xml" ) )
+    addresses = numpy.array( [ int( dm.find( name ).address, 0 ) for name in
+        ( "dmcontrol", "dmstatus", "abstractcs", "command", "data0" ) ] )
+    rng = numpy.random.default_rng( 0 )
+    with open( path, "wb" ) as f:
+        for start in range( 0, records, 1 << 22 ):
+            count = min( 1 << 22, records - start )
+            fields = { "address": rng.choice( addresses, count ),
+                    "data": rng.integers( 0, 2**32, count, dtype=numpy.uint64 ),
+                    "op": rng.integers( 1, 3, count ) }
+            codec.encode( fields ).tofile( f )
+
+def query( capture, dm, chunk ):
+    """Return the indices of writes to command followed by a read of
+    abstractcs with cmderr set."""
+    command = int( dm.find( "command" ).address, 0 )
+    abstractcs = dm.find( "abstractcs" )
+    address = int( abstractcs.address, 0 )
+    codec = abstractcs.codec()
+    writes = []
+    reads = []
+    failed = []
+    for start, fields in capture.chunks( chunk ):
+        writes.append( start + numpy.flatnonzero( ( fields["op"] == 2 ) &
+            ( fields["address"] == command ) ) )
+        read = numpy.flatnonzero( ( fields["op"] == 1 ) &
+                ( fields["address"] == address ) )
+        reads.append( start + read )
+        failed.append( codec.decode( fields["data"][read] )["cmderr"] != 0 )
+    writes = numpy.concatenate( writes )
+    reads = numpy.concatenate( reads )
+    failed = numpy.concatenate( failed )
+    following = numpy.searchsorted( reads, writes )
+    found = following < len( reads )
+    return writes[found][ failed[following[found]] ]
+
+def main():
+    parser = argparse.ArgumentParser( description=__doc__ )
+    parser.add_argument( '--capture',
+            help='Capture file to decode. One is written if it doesn\'t '
+            'exist.' )
+    parser.add_argument( '--records', type=int, default=10000000,
+            help='Number of scans in the capture that is written.' )
+    parser.add_argument( '--abits', type=int, default=7,
+            help='Value of abits, which sets the width of dmi.' )
+    parser.add_argument( '--chunk', type=int, default=1 << 20,
+            help='Records to decode at a time.' )
+    parser.add_argument( '--json',
+            help='Also write the results to the named file.' )
+    parsed = parser.parse_args()
+
+    dmi = registers.load( os.path.join( XML_DIR, "jtag_registers.xml" ) ).find( "dmi" )
+    dm = registers.load( os.path.join( XML_DIR, "dm_registers.xml" ) )
+    with tempfile.TemporaryDirectory() as tmp:
+        path = parsed.capture or os.path.join( tmp, "dmi.bin" )
+        if not os.path.exists( path ):
+            write_capture( path, dmi, parsed.records, parsed.abits )
+        rss = resource.getrusage( resource.RUSAGE_SELF ).ru_maxrss
+        start = time.perf_counter()
+        capture = registers.Capture( path, dmi, { "abits": parsed.abits } )
+        found = query( capture, dm, parsed.chunk )
+        seconds = time.perf_counter() - start
+        growth = resource.getrusage( resource.RUSAGE_SELF ).ru_maxrss - rss
+        result = { "records": len( capture ),
+                "bytes": os.path.getsize( path ), "found": len( found ),
+                "seconds": round( seconds, 3 ),
+                "records_per_second": round( len( capture ) / seconds ),
+                "max_rss_growth_kb": growth }
+    print( "%d records (%d bytes): %d matches in %.3f s, %.1fM records/s, "
+            "max RSS (including mapped pages) grew %d KB" % ( result["records"], result["bytes"],
+                result["found"], seconds, result["records_per_second"] / 1e6,
+                growth ) )
+
+    if parsed.json:
+        with open( parsed.json, "w" ) as f:
+            json.dump( result, f, indent=2 )
+            f.write( "\n" )
+
+if __name__ == "__main__":
+    sys.exit( main() )
@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+
+"""Compare decoding captured register values into fields one value at a time
+in Python with decoding them with a RegisterCodec, on random values."""
+
+import argparse
+import json
+import os
+import sys
+import time
+
+ROOT = os.path.dirname( os.path.dirname( os.path.abspath( __file__ ) ) )
+sys.path.insert( 0, ROOT )
+import numpy
+import registers
+
+def loop_decode( codec, raw ):
+    """Decode raw the way hand written Python does."""
+    fields = [ ( name, int( shift ), int( mask ) ) for name, shift, mask in
+            zip( codec.names, codec.shifts, codec.masks ) ]
+    return [ { name: ( value >> shift ) & mask for name, shift, mask in fields }
+            for value in raw.tolist() ]
+
+def best_time( function, repeat ):
+    best = None
+    for _ in range( repeat ):
+        start = time.perf_counter()
+        function()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min( best, elapsed )
+    return best
+
+def main():
+    parser = argparse.ArgumentParser( description=__doc__ )
+    parser.add_argument( '--xml', default=os.path.join( ROOT, "xml",
+        "dm_registers.xml" ), help='XML file the registers are in.' )
+    parser.add_argument( '--register', action='append',
+            help='Register to decode. May be given more than once. Defaults '
+            'to dmstatus, abstractcs and sbcs.' )
+    parser.add_argument( '--samples', type=int, default=1000000,
+            help='Number of values to decode.' )
+    parser.add_argument( '--loop-samples', type=int, default=100000,
+            help='Number of values to decode with the Python loop, which is '
+            'scaled up to --samples.' )
+    parser.add_argument( '--xlen', type=int, default=64,
+            help='Value of XLEN (and DXLEN) for registers that depend on it.' )
+    parser.add_argument( '--repeat', type=int, default=3,
+            help='Report the fastest of this many runs.' )
+    parser.add_argument( '--json',
+            help='Also write the results to the named file.' )
+    parsed = parser.parse_args()
+
+    model = registers.load( parsed.xml )
+    rng = numpy.random.default_rng( 0 )
+    raw = rng.integers( 0, 2**63, parsed.samples, dtype=numpy.uint64 )
+    results = []
+    for name in parsed.register or [ "dmstatus", "abstractcs", "sbcs" ]:
+        register = model.find( name )
+        codec = register.codec( { "XLEN": parsed.xlen, "DXLEN": parsed.xlen } )
+        numpy_s = best_time( lambda: codec.decode( raw ), parsed.repeat )
+        encode_s = best_time( lambda: codec.encode( codec.decode( raw ) ),
+                parsed.repeat ) - numpy_s
+        loop = raw[:parsed.loop_samples]
+        loop_s = best_time( lambda: loop_decode( codec, loop ), parsed.repeat ) * \
+                parsed.samples / max( len( loop ), 1 )
+        results.append( { "register": register.short, "fields": len( codec.names ),
+            "samples": parsed.samples, "loop_s": round( loop_s, 4 ),
+            "decode_s": round( numpy_s, 4 ), "encode_s": round( encode_s, 4 ) } )
+        print( "%-12s %3d fields %10d samples  loop %8.3f s  decode %8.3f s "
+                "(%5.1fx)  encode %8.3f s" % ( register.short, len( codec.names ),
+                    parsed.samples, loop_s, numpy_s, loop_s / numpy_s, encode_s ) )
+
+    if parsed.json:
+        with open( parsed.json, "w" ) as f:
+            json.dump( results, f, indent=2 )
+            f.write( "\n" )
+
+if __name__ == "__main__":
+    sys.exit( main() )
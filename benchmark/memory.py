@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+
+"""Measure how much memory the fully loaded register models take, per file
+and per field. Use --copies to see what keeping several versions of the same
+files resident costs, e.g. in a long-running service."""
+
+import argparse
+import gc
+import json
+import os
+import sys
+import tracemalloc
+
+ROOT = os.path.dirname( os.path.dirname( os.path.abspath( __file__ ) ) )
+XML_DIR = os.path.join( ROOT, "xml" )
+sys.path.insert( 0, ROOT )
+import registers
+
+def field_count( model ):
+    return sum( len( r.fields ) for r in model.registers )
+
+def retained( function ):
+    """Call function, and return what it returned and how many bytes that
+    still holds on to."""
+    gc.collect()
+    tracemalloc.start()
+    try:
+        before = tracemalloc.get_traced_memory()[0]
+        result = function()
+        gc.collect()
+        return result, tracemalloc.get_traced_memory()[0] - before
+    finally:
+        tracemalloc.stop()
+
+def main():
+    parser = argparse.ArgumentParser( description=__doc__ )
+    parser.add_argument( 'xml', nargs='*',
+            help='XML files to load. Defaults to every file in xml/.' )
+    parser.add_argument( '--copies', type=int, default=1,
+            help='Load every file this many times, and keep all the copies.' )
+    parser.add_argument( '--json',
+            help='Also write the results to the named file.' )
+    parser.add_argument( '--budget', type=float, metavar='BYTES',
+            help='Exit with an error if the whole model takes more than this '
+            'many bytes per field.' )
+    parsed = parser.parse_args()
+
+    paths = parsed.xml or sorted(
+            os.path.join( XML_DIR, name ) for name in os.listdir( XML_DIR )
+            if name.endswith( ".xml" ) )
+
+    results = []
+    def record( name, models, size ):
+        fields = sum( field_count( m ) for m in models )
+        results.append( { "name": name,
+            "registers": sum( len( m.registers ) for m in models ),
+            "fields": fields, "bytes": size,
+            "bytes_per_field": round( size / max( fields, 1 ), 1 ) } )
+        print( "%-24s %6d registers %6d fields %10d bytes %8.1f bytes/field" %
+                ( name, results[-1]["registers"], fields, size,
+                    results[-1]["bytes_per_field"] ) )
+
+    for path in paths:
+        model, size = retained( lambda: registers.parse_xml( path ) )
+        record( os.path.basename( path ), [ model ], size )
+    # Loaded together, the models may share things like interned strings.
+    models, size = retained( lambda: [ registers.parse_xml( path )
+        for _ in range( parsed.copies ) for path in paths ] )
+    record( "all (%d copies)" % parsed.copies if parsed.copies > 1 else "all",
+            models, size )
+
+    if parsed.json:
+        with open( parsed.json, "w" ) as f:
+            json.dump( results, f, indent=2 )
+            f.write( "\n" )
+
+    if parsed.budget is not None and results[-1]["bytes_per_field"] > parsed.budget:
+        print( "The model takes %.1f bytes per field, over the budget of %.1f" %
+                ( results[-1]["bytes_per_field"], parsed.budget ), file=sys.stderr )
+        return 1
+
+if __name__ == "__main__":
+    sys.exit( main() )
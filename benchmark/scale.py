@@ -0,0 +1,213 @@
+#!/usr/bin/env python3
+
+"""Time each phase of registers.py on synthetic register descriptions of
+increasing size, to see how the generator scales.
+
+Every size parameter takes a comma separated list, and every combination is
+measured. For example:
+
+    benchmark/scale.py --registers 10,100,1000 --save results.json
+    benchmark/scale.py --registers 10,100,1000 --baseline results.json
+"""
+
+import argparse
+import contextlib
+import io
+import itertools
+import json
+import os
+import sys
+import tempfile
+import time
+import xml.sax.saxutils
+
+ROOT = os.path.dirname( os.path.dirname( os.path.abspath( __file__ ) ) )
+sys.path.insert( 0, ROOT )
+import registers
+
+PHASES = ( "parse_xml", "check", "write_adoc", "write_cheader",
+        "print_cgetters", "write_chisel" )
+
+def split_bits( width, count ):
+    """Split width bits into count contiguous fields, as evenly as possible.
+    Return a list of (high, low) strings, most significant first."""
+    bits = []
+    low = width
+    for i in range( count ):
+        high = low - 1
+        low -= width // count + ( i < width % count )
+        bits.append(( str( high ), str( low ) ))
+    return bits
+
+def field_bits( width, count, symbolic ):
+    """Return the bits of count fields that make up a register. If symbolic,
+    the top of the register depends on XLEN, the way the trigger registers
+    do."""
+    count = max( 1, min( count, width ) )
+    if symbolic and count >= 3:
+        numeric = split_bits( width - 8, min( count - 3, width - 8 ) )
+        top = str( int( numeric[0][0] ) + 1 ) if numeric else "0"
+        return [ ( "XLEN-1", "XLEN-4" ), ( "XLEN-5", "XLEN-5" ),
+                ( "XLEN-6", top ) ] + numeric
+    bits = split_bits( width, count )
+    if symbolic:
+        bits[0] = ( "XLEN-1", bits[0][1] )
+    return bits
+
+def synthetic_xml( register_count, fields, values, symbolic_fraction, width=32 ):
+    """Return the text of a register description file."""
+    e = xml.sax.saxutils.escape
+    lines = [ '<registers name="Synthetic Registers" label="synthetic" prefix="SYN_">',
+            "Synthetic registers for benchmarking." ]
+    symbolic_count = round( register_count * symbolic_fraction )
+    for r in range( register_count ):
+        symbolic = r < symbolic_count
+        lines.append( '<register name="Register %d" short="reg%d" address="%#x">' %
+                ( r, r, 0x1000 + r ) )
+        lines.append( "Description of register %d." % r )
+        for f, ( high, low ) in enumerate( field_bits( width, fields, symbolic ) ):
+            bits = high if high == low else "%s:%s" % ( high, low )
+            lines.append( '<field name="field%d" bits="%s" access="R/W" reset="0">' %
+                    ( f, e( bits ) ) )
+            lines.append( "Description of field %d of register %d." % ( f, r ) )
+            try:
+                length = int( high ) - int( low ) + 1
+            except ValueError:
+                # Like the real XML, only give values to fields with a fixed
+                # width.
+                length = 0
+            for v in range( min( values, 2 ** length if length else 0 ) ):
+                lines.append( '<value v="%d" name="value%d">Value %d.</value>' %
+                        ( v, v, v ) )
+            lines.append( "</field>" )
+        lines.append( "</register>" )
+    lines.append( "</registers>" )
+    return "\n".join( lines ) + "\n"
+
+def best_time( function, repeat ):
+    """Return the fastest time in seconds of repeat calls to function, and
+    what the last call returned."""
+    best = None
+    for _ in range( repeat ):
+        start = time.perf_counter()
+        result = function()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min( best, elapsed )
+    return best, result
+
+def measure( path, repeat ):
+    """Return a dict of phase name to seconds, for the XML file at path.
+    Phases that fail (e.g. write_chisel on symbolic registers) are None."""
+    timings = {}
+    timings["parse_xml"], model = best_time( lambda: registers.parse_xml( path ),
+            repeat )
+    # parse_xml() includes check(), so time it again on its own.
+    timings["check"], _ = best_time(
+            lambda: [ r.check() for r in model.registers ], repeat )
+
+    sink = io.StringIO
+    backends = {
+        "write_adoc": lambda: registers.write_adoc( sink(), model ),
+        "write_cheader": lambda: registers.write_cheader( sink(), model ),
+        "print_cgetters": lambda: registers.print_cgetters( [ model ], sink(),
+            sink() ),
+        "write_chisel": lambda: registers.write_chisel( sink(), model ),
+    }
+    for name, function in backends.items():
+        try:
+            with contextlib.redirect_stdout( io.StringIO() ):
+                timings[name], _ = best_time( function, repeat )
+        except (TypeError, ValueError):
+            timings[name] = None
+    return timings
+
+def int_list( text ):
+    return [ int( t ) for t in text.split( "," ) ]
+
+def float_list( text ):
+    return [ float( t ) for t in text.split( "," ) ]
+
+def case_key( case ):
+    return tuple( case[k] for k in ( "registers", "fields", "values", "symbolic" ) )
+
+def compare( results, baseline, threshold ):
+    """Print how results compare to baseline. Return True if any phase got
+    slower by more than threshold."""
+    old = { case_key( c ): c for c in baseline }
+    regressed = False
+    for case in results:
+        previous = old.get( case_key( case ) )
+        if not previous:
+            continue
+        for phase in PHASES:
+            now = case["seconds"].get( phase )
+            then = previous["seconds"].get( phase )
+            if not now or not then:
+                continue
+            ratio = now / then
+            flag = ""
+            if ratio > threshold:
+                flag = "  REGRESSION"
+                regressed = True
+            print( "%-48s %-15s %8.3f s -> %8.3f s (%5.2fx)%s" % (
+                "registers=%d fields=%d values=%d symbolic=%g" % case_key( case ),
+                phase, then, now, ratio, flag ) )
+    return regressed
+
+def main():
+    parser = argparse.ArgumentParser( description=__doc__,
+            formatter_class=argparse.RawDescriptionHelpFormatter )
+    parser.add_argument( '--registers', type=int_list, default=[ 10, 100, 1000 ],
+            help='Number of registers per file.' )
+    parser.add_argument( '--fields', type=int_list, default=[ 8 ],
+            help='Fields per register.' )
+    parser.add_argument( '--values', type=int_list, default=[ 4 ],
+            help='Enumerated values per field (limited by the field width).' )
+    parser.add_argument( '--symbolic', type=float_list, default=[ 0.25 ],
+            help='Fraction of registers whose bit ranges depend on XLEN.' )
+    parser.add_argument( '--repeat', type=int, default=3,
+            help='Report the fastest of this many runs of each phase.' )
+    parser.add_argument( '--save',
+            help='Write the results to the named JSON file.' )
+    parser.add_argument( '--baseline',
+            help='Compare the results to this JSON file written by --save.' )
+    parser.add_argument( '--threshold', type=float, default=1.25,
+            help='With --baseline, exit with an error if any phase is slower '
+            'than the baseline by more than this factor.' )
+    parser.add_argument( '--keep-xml', metavar='DIR',
+            help='Write the synthetic XML files to this directory.' )
+    parsed = parser.parse_args()
+
+    results = []
+    print( "%-48s %s" % ( "", " ".join( "%14s" % p for p in PHASES ) ) )
+    with tempfile.TemporaryDirectory() as tmp:
+        directory = parsed.keep_xml or tmp
+        os.makedirs( directory, exist_ok=True )
+        for register_count, fields, values, symbolic in itertools.product(
+                parsed.registers, parsed.fields, parsed.values, parsed.symbolic ):
+            case = { "registers": register_count, "fields": fields,
+                    "values": values, "symbolic": symbolic }
+            path = os.path.join( directory, "synthetic_%d_%d_%d_%g.xml" %
+                    case_key( case ) )
+            with open( path, "w" ) as f:
+                f.write( synthetic_xml( register_count, fields, values, symbolic ) )
+            case["seconds"] = measure( path, parsed.repeat )
+            results.append( case )
+            print( "%-48s %s" % (
+                "registers=%d fields=%d values=%d symbolic=%g" % case_key( case ),
+                " ".join( "%14s" % ( "-" if case["seconds"][p] is None else
+                    "%.4f" % case["seconds"][p] ) for p in PHASES ) ) )
+
+    if parsed.save:
+        with open( parsed.save, "w" ) as f:
+            json.dump( results, f, indent=2 )
+            f.write( "\n" )
+
+    if parsed.baseline:
+        with open( parsed.baseline ) as f:
+            baseline = json.load( f )
+        if compare( results, baseline, parsed.threshold ):
+            return 1
+
+if __name__ == "__main__":
+    sys.exit( main() )
@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+
+"""Measure how long registers.py takes to start, and to run each backend on
+each XML file from a cold start (a fresh interpreter every time)."""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname( os.path.dirname( os.path.abspath( __file__ ) ) )
+REGISTERS_PY = os.path.join( ROOT, "registers.py" )
+XML_DIR = os.path.join( ROOT, "xml" )
+
+# Arguments for each backend. {out} is replaced with an output path in a
+# temporary directory, {xml} with the XML file.
+BACKENDS = {
+    "adoc": [ "--adoc", "{out}.adoc", "{xml}" ],
+    "adoc-definitions": [ "--adoc-definitions", "{out}-def.adoc", "{xml}" ],
+    "cheader": [ "--cheader", "{out}.h", "{xml}" ],
+    "chisel": [ "--chisel", "{out}.scala", "{xml}" ],
+    "python": [ "--python", "{out}.py", "{xml}" ],
+    "cgetters": [ "{out}", "--cgetters", "{xml}" ],
+}
+
+def run( args, repeat ):
+    """Run python with args repeat times. Return the fastest wall clock time
+    in ms (None if python failed), and whether sympy was imported."""
+    best = None
+    sympy_imported = False
+    for _ in range( repeat ):
+        start = time.perf_counter()
+        result = subprocess.run( [ sys.executable, "-X", "importtime" ] + args,
+                stdout=subprocess.DEVNULL, stderr=subprocess.PIPE,
+                universal_newlines=True )
+        if result.returncode:
+            return None, False
+        elapsed = ( time.perf_counter() - start ) * 1000
+        best = elapsed if best is None else min( best, elapsed )
+        sympy_imported = any(
+                line.split( "|" )[-1].strip().split( "." )[0] == "sympy"
+                for line in result.stderr.splitlines() )
+    return best, sympy_imported
+
+def main():
+    parser = argparse.ArgumentParser( description=__doc__ )
+    parser.add_argument( 'xml', nargs='*',
+            help='XML files to measure. Defaults to every file in xml/.' )
+    parser.add_argument( '--backend', action='append', choices=BACKENDS,
+            help='Only measure this backend. May be given more than once.' )
+    parser.add_argument( '--repeat', type=int, default=3,
+            help='Report the fastest of this many runs.' )
+    parser.add_argument( '--json',
+            help='Also write the results to the named file.' )
+    parser.add_argument( '--budget', type=float, metavar='MS',
+            help='Exit with an error if importing registers.py or running '
+            '--help takes longer than this.' )
+    parsed = parser.parse_args()
+
+    paths = parsed.xml or sorted(
+            os.path.join( XML_DIR, name ) for name in os.listdir( XML_DIR )
+            if name.endswith( ".xml" ) )
+    backends = parsed.backend or list( BACKENDS )
+
+    results = []
+    def record( name, xml, args ):
+        ms, sympy_imported = run( args, parsed.repeat )
+        results.append( { "name": name, "xml": xml,
+            "ms": None if ms is None else round( ms, 1 ),
+            "sympy": sympy_imported } )
+        if ms is None:
+            print( "%-20s %-24s   failed" % ( name, xml or "" ) )
+        else:
+            print( "%-20s %-24s %8.1f ms%s" % ( name, xml or "",
+                ms, "  (sympy)" if sympy_imported else "" ) )
+
+    record( "python", None, [ "-c", "pass" ] )
+    record( "import", None, [ "-c", "import sys; sys.path.insert(0, %r); "
+        "import registers" % ROOT ] )
+    record( "--help", None, [ REGISTERS_PY, "--help" ] )
+    with tempfile.TemporaryDirectory() as tmp:
+        for path in paths:
+            name = os.path.splitext( os.path.basename( path ) )[0]
+            out = os.path.join( tmp, name )
+            for backend in backends:
+                args = [ a.format( out=out, xml=path ) for a in BACKENDS[backend] ]
+                record( backend, os.path.basename( path ), [ REGISTERS_PY ] + args )
+
+    if parsed.json:
+        with open( parsed.json, "w" ) as f:
+            json.dump( results, f, indent=2 )
+            f.write( "\n" )
+
+    if parsed.budget is not None:
+        over = [ r for r in results if r["name"] in ( "import", "--help" ) and
+                r["ms"] > parsed.budget ]
+        for r in over:
+            print( "%s took %.1f ms, over the budget of %.1f ms" % ( r["name"],
+                r["ms"], parsed.budget ), file=sys.stderr )
+        if over:
+            return 1
+
+if __name__ == "__main__":
+    sys.exit( main() )
@@ -4,18 +4,22 @@
 #include <inttypes.h>
 #include <assert.h>
 #include <stdarg.h>
+#include <stdint.h>
 
 #include "debug_reg_printer.h"
 
-static unsigned int get_len_or_sprintf(char *buf, unsigned int curr, const char *format, ...)
+/* Unless size is SIZE_MAX, write at most size bytes to buf, like snprintf(). */
+static unsigned int get_len_or_sprintf(char *buf, size_t size, unsigned int curr, const char *format, ...)
 {
 	assert(format);
 	va_list args;
 	int length;
 
 	va_start(args, format);
-	if (buf)
+	if (buf && size == SIZE_MAX)
 		length = vsprintf(buf + curr, format, args);
+	else if (buf && curr < size)
+		length = vsnprintf(buf + curr, size - curr, format, args);
 	else
 		length = vsnprintf(NULL, 0, format, args);
 	va_end(args);
@@ -23,33 +27,50 @@ static unsigned int get_len_or_sprintf(char *buf, unsigned int curr, const char
 	return (unsigned int)length;
 }
 
-static unsigned int print_number(char *buf, unsigned int offset, uint64_t value)
+static unsigned int print_number(char *buf, size_t size, unsigned int offset, uint64_t value)
 {
 	const char * const format = value > 9 ? "0x%" PRIx64 : "%" PRIx64;
 
-	return get_len_or_sprintf(buf, offset, format, value);
+	return get_len_or_sprintf(buf, size, offset, format, value);
 }
 
-static unsigned int riscv_debug_reg_field_value_to_s(char *buf, unsigned int offset,
-		const char * const *field_value_names, uint64_t field_value)
+static const char *riscv_debug_reg_value_name(riscv_debug_reg_field_info_t field,
+		uint64_t named_value)
 {
-	const char * const field_value_name = field_value_names ?
-		field_value_names[field_value] :
-		NULL;
+	if (field.values)
+		return field.values[named_value];
+
+	/* Binary search the sorted names of a wide field. */
+	unsigned int low = 0;
+	unsigned int high = field.value_name_count;
+	while (low < high) {
+		const unsigned int middle = low + (high - low) / 2;
+		if (field.value_names[middle].value == named_value)
+			return field.value_names[middle].name;
+		if (field.value_names[middle].value < named_value)
+			low = middle + 1;
+		else
+			high = middle;
+	}
+	return NULL;
+}
 
+static unsigned int riscv_debug_reg_field_value_to_s(char *buf, size_t size, unsigned int offset,
+		const char *field_value_name, uint64_t field_value)
+{
 	if (!field_value_name)
-		return print_number(buf, offset, field_value);
-	return get_len_or_sprintf(buf, offset, "%s", field_value_name);
+		return print_number(buf, size, offset, field_value);
+	return get_len_or_sprintf(buf, size, offset, "%s", field_value_name);
 }
 
-static unsigned int riscv_debug_reg_field_to_s(char *buf, unsigned int offset,
+static unsigned int riscv_debug_reg_field_to_s(char *buf, size_t size, unsigned int offset,
 		riscv_debug_reg_field_info_t field, riscv_debug_reg_ctx_t context,
-		uint64_t field_value)
+		uint64_t field_value, const char *field_value_name)
 {
-	const unsigned int name_len = get_len_or_sprintf(buf, offset, "%s=", field.name);
+	const unsigned int name_len = get_len_or_sprintf(buf, size, offset, "%s=", field.name);
 
-	return name_len + riscv_debug_reg_field_value_to_s(buf, offset + name_len,
-			field.values, field_value);
+	return name_len + riscv_debug_reg_field_value_to_s(buf, size, offset + name_len,
+			field_value_name, field_value);
 }
 
 static uint64_t riscv_debug_reg_field_value(riscv_debug_reg_field_info_t field, uint64_t value)
@@ -60,35 +81,74 @@ static uint64_t riscv_debug_reg_field_value(riscv_debug_reg_field_info_t field,
 	return (value & trailing_ones_mask) >> field.lsb;
 }
 
-static unsigned int riscv_debug_reg_fields_to_s(char *buf, unsigned int offset,
+static unsigned int riscv_debug_reg_shown_field_to_s(char *buf, size_t size, unsigned int offset,
+		riscv_debug_reg_field_info_t field, riscv_debug_reg_ctx_t context,
+		uint64_t value, enum riscv_debug_reg_show show, const char **separator)
+{
+	uint64_t field_value = riscv_debug_reg_field_value(field, value);
+	uint64_t named_value = field_value;
+	if (field.upper_bits) {
+		/* The names are for this field combined with its upper part. */
+		const uint64_t upper = (value >> field.upper_lsb) &
+			((UINT64_C(1) << field.upper_bits) - 1);
+		named_value |= upper << (field.msb - field.lsb + 1);
+	}
+	const char *field_value_name = (field.values || field.value_names) ?
+		riscv_debug_reg_value_name(field, named_value) : NULL;
+
+	if (show == RISCV_DEBUG_REG_SHOW_ALL ||
+			(show == RISCV_DEBUG_REG_HIDE_UNNAMED_0 &&
+				(field_value != 0 || field_value_name)) ||
+			(show == RISCV_DEBUG_REG_HIDE_ALL_0 && field_value != 0)) {
+		unsigned int curr = offset;
+		curr += get_len_or_sprintf(buf, size, curr, *separator);
+		curr += riscv_debug_reg_field_to_s(buf, size, curr, field, context,
+						field_value, field_value_name);
+		*separator = " ";
+		return curr - offset;
+	}
+	return 0;
+}
+
+#ifdef RISCV_DEBUG_REG_FIELD_TABLES
+static unsigned int riscv_debug_reg_fields_to_s(char *buf, size_t size, unsigned int offset,
+	const riscv_debug_reg_field_desc_t *fields, unsigned int field_count,
+	riscv_debug_reg_ctx_t context, uint64_t value,
+	enum riscv_debug_reg_show show)
+{
+	unsigned int curr = offset;
+	curr += get_len_or_sprintf(buf, size, curr, " {");
+	const char *separator = "";
+	for (unsigned int i = 0; i < field_count; i++) {
+		riscv_debug_reg_field_info_t field =
+			riscv_debug_reg_resolve_field(fields[i], context);
+		curr += riscv_debug_reg_shown_field_to_s(buf, size, curr, field, context,
+				value, show, &separator);
+	}
+	curr += get_len_or_sprintf(buf, size, curr, "}");
+	return curr - offset;
+}
+#else
+static unsigned int riscv_debug_reg_fields_to_s(char *buf, size_t size, unsigned int offset,
 	struct riscv_debug_reg_field_list_t (*get_next)(riscv_debug_reg_ctx_t contex),
 	riscv_debug_reg_ctx_t context, uint64_t value,
 	enum riscv_debug_reg_show show)
 {
 	unsigned int curr = offset;
-	curr += get_len_or_sprintf(buf, curr, " {");
-	char *separator = "";
+	curr += get_len_or_sprintf(buf, size, curr, " {");
+	const char *separator = "";
 	for (struct riscv_debug_reg_field_list_t list; get_next; get_next = list.get_next) {
 		list = get_next(context);
-
-		uint64_t field_value = riscv_debug_reg_field_value(list.field, value);
-
-		if (show == RISCV_DEBUG_REG_SHOW_ALL ||
-				(show == RISCV_DEBUG_REG_HIDE_UNNAMED_0 &&
-					(field_value != 0 ||
-						(list.field.values && list.field.values[0]))) ||
-				(show == RISCV_DEBUG_REG_HIDE_ALL_0 && field_value != 0)) {
-			curr += get_len_or_sprintf(buf, curr, separator);
-			curr += riscv_debug_reg_field_to_s(buf, curr, list.field, context,
-							field_value);
-			separator = " ";
-		}
+		curr += riscv_debug_reg_shown_field_to_s(buf, size, curr, list.field, context,
+				value, show, &separator);
 	}
-	curr += get_len_or_sprintf(buf, curr, "}");
+	curr += get_len_or_sprintf(buf, size, curr, "}");
 	return curr - offset;
 }
+#endif
 
-unsigned int riscv_debug_reg_to_s(char *buf, enum riscv_debug_reg_ordinal reg_ordinal,
+static unsigned int riscv_debug_reg_to_s_sized(char *buf, size_t size,
+		enum riscv_debug_reg_ordinal reg_ordinal,
 		riscv_debug_reg_ctx_t context, uint64_t value,
 		enum riscv_debug_reg_show show)
 {
@@ -96,14 +156,37 @@ unsigned int riscv_debug_reg_to_s(char *buf, enum riscv_debug_reg_ordinal reg_or
 
 	riscv_debug_reg_info_t reg = get_riscv_debug_reg_info(reg_ordinal);
 
-	length += get_len_or_sprintf(buf, length, "%s=", reg.name);
-	length += print_number(buf, length, value);
+	length += get_len_or_sprintf(buf, size, length, "%s=", reg.name);
+	length += print_number(buf, size, length, value);
 
+#ifdef RISCV_DEBUG_REG_FIELD_TABLES
+	if (reg.field_count)
+		length += riscv_debug_reg_fields_to_s(buf, size, length,
+				reg.fields, reg.field_count, context, value, show);
+#else
 	if (reg.get_fields_head)
-		length += riscv_debug_reg_fields_to_s(buf, length,
+		length += riscv_debug_reg_fields_to_s(buf, size, length,
 				reg.get_fields_head, context, value, show);
+#endif
 
-	if (buf)
-		buf[length] = '\0';
+	if (buf && size)
+		buf[length < size ? length : size - 1] = '\0';
 	return length;
 }
+
+unsigned int riscv_debug_reg_to_s(char *buf, enum riscv_debug_reg_ordinal reg_ordinal,
+		riscv_debug_reg_ctx_t context, uint64_t value,
+		enum riscv_debug_reg_show show)
+{
+	return riscv_debug_reg_to_s_sized(buf, SIZE_MAX, reg_ordinal, context,
+			value, show);
+}
+
+unsigned int riscv_debug_reg_to_s_bounded(char *buf, size_t size,
+		enum riscv_debug_reg_ordinal reg_ordinal,
+		riscv_debug_reg_ctx_t context, uint64_t value,
+		enum riscv_debug_reg_show show)
+{
+	return riscv_debug_reg_to_s_sized(buf, size, reg_ordinal, context,
+			value, show);
+}
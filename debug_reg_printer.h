@@ -1,5 +1,8 @@
 /* SPDX-License-Identifier: GPL-2.0-or-later */
 
+#include <stddef.h>
+#include <stdint.h>
+
 #include "debug_defines.h"
 
 enum riscv_debug_reg_show {
@@ -33,3 +36,23 @@ enum riscv_debug_reg_show {
 unsigned int riscv_debug_reg_to_s(char *buf, enum riscv_debug_reg_ordinal reg_ordinal,
 		riscv_debug_reg_ctx_t context, uint64_t value,
 		enum riscv_debug_reg_show show);
+
+/**
+ * Like riscv_debug_reg_to_s(), but write at most size bytes (including the
+ * '\0') to buf, so the string can be formatted in a single pass. A buffer of
+ * get_riscv_debug_reg_info(reg_ordinal).to_s_max_length + 1 bytes, or of
+ * RISCV_DEBUG_REG_TO_S_MAX_LENGTH + 1 bytes for any register, is always big
+ * enough.
+ *
+ * Returns the length of the whole string representation (excluding '\0'),
+ * like snprintf(). If that is size or more, the output was truncated.
+ *
+ * Example:
+ * char buf[RISCV_DEBUG_REG_TO_S_MAX_LENGTH + 1];
+ * riscv_debug_reg_to_s_bounded(buf, sizeof(buf), DTM_DMI_ORDINAL, context,
+ *         <dmi value>, RISCV_DEBUG_REG_SHOW_ALL);
+ */
+unsigned int riscv_debug_reg_to_s_bounded(char *buf, size_t size,
+		enum riscv_debug_reg_ordinal reg_ordinal,
+		riscv_debug_reg_ctx_t context, uint64_t value,
+		enum riscv_debug_reg_show show);
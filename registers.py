@@ -1,19 +1,146 @@
 #!/usr/bin/env python3
 
-from datetime import datetime
+"""Generate documentation, C and Chisel from the register descriptions in
+xml/.
+
+Run this script with --help to see how to generate files. It can also be
+imported as a library:
+
+    import registers
+    dm = registers.load( "xml/dm_registers.xml" )
+    field = dm.find( "dmstatus" ).find_field( "allhalted" )
+    text = registers.render( registers.write_cheader, dm )
+
+Raw values of a register can be decoded into fields (and encoded back)
+for whole NumPy arrays at once:
+
+    codec = dm.find( "dmstatus" ).codec()
+    fields = codec.decode( numpy.fromfile( "dmstatus.bin", "<u4" ) )
+    allhalted = fields["allhalted"]
+
+Values read from an address that several registers share (like tdata1 and
+the trigger registers aliasing it) are decoded with the register their
+discriminator field selects:
+
+    tdata1 = registers.load( "xml/hwbp_registers.xml" ).find( "tdata1" )
+    triggers = tdata1.dispatch().codec( { "XLEN": 64 } ).decode( raw )
+
+Binary captures of a register, like JTAG dmi scans, are memory-mapped:
+
+    dmi = registers.load( "xml/jtag_registers.xml" ).find( "dmi" )
+    capture = registers.Capture( "scans.bin", dmi, { "abits": 7 } )
+    writes = capture.where( lambda fields: fields["op"] == 2 )
+
+sympy is only imported when an expression actually needs it, and numpy only
+when a RegisterCodec is made."""
+
+from datetime import datetime, timezone
 import sys
 import xml.etree.ElementTree
 import argparse
-import sympy
-from sympy.functions.elementary.miscellaneous import Max
+import contextlib
+import functools
+import hashlib
+import io
+import json
+import os
+import pickle
+import select
+import shlex
+import tempfile
+import time
+import traceback
+import importlib
 import math
 import re
 import collections
+import csv
+import itertools
 import operator
 from functools import cmp_to_key
 from functools import reduce
 
+class LazyModule( object ):
+    """A module that is only imported when one of its attributes is used."""
+    def __init__( self, name ):
+        self._name = name
+        self._module = None
+
+    def __getattr__( self, attribute ):
+        if self._module is None:
+            with stats.timer( "import " + self._name ):
+                self._module = importlib.import_module( self._name )
+        return getattr( self._module, attribute )
+
+sympy = LazyModule( "sympy" )
+numpy = LazyModule( "numpy" )
+
+class Stats( object ):
+    """Wall clock timers and counters describing what a run spent its time
+    on. Timers are inclusive, so e.g. parse_xml includes check."""
+    def __init__( self ):
+        self.reset()
+
+    def reset( self ):
+        # name -> [seconds, calls]
+        self.timers = {}
+        # name -> count
+        self.counters = {}
+
+    @contextlib.contextmanager
+    def timer( self, name ):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            timer = self.timers.setdefault( name, [0.0, 0] )
+            timer[0] += time.perf_counter() - start
+            timer[1] += 1
+
+    def count( self, name, n=1 ):
+        self.counters[name] = self.counters.get( name, 0 ) + n
+
+    def snapshot( self ):
+        return { "timers": { k: list( v ) for k, v in self.timers.items() },
+                "counters": dict( self.counters ) }
+
+    def merge( self, snapshot ):
+        """Add in the snapshot() of another Stats, e.g. from a worker
+        process."""
+        for name, ( seconds, calls ) in snapshot["timers"].items():
+            timer = self.timers.setdefault( name, [0.0, 0] )
+            timer[0] += seconds
+            timer[1] += calls
+        for name, n in snapshot["counters"].items():
+            self.count( name, n )
+
+    def to_json( self ):
+        return {
+            "timers": { name: { "seconds": round( seconds, 6 ), "calls": calls }
+                for name, ( seconds, calls ) in sorted( self.timers.items() ) },
+            "counters": dict( sorted( self.counters.items() ) ) }
+
+stats = Stats()
+
+def timed( name ):
+    """Decorator that adds the time spent in a function to stats."""
+    def decorator( function ):
+        @functools.wraps( function )
+        def wrapper( *args, **kwargs ):
+            with stats.timer( name ):
+                return function( *args, **kwargs )
+        return wrapper
+    return decorator
+
+def simplify( expression ):
+    stats.count( "sympy.simplify" )
+    return sympy.simplify( expression )
+
 class Registers( object ):
+    __slots__ = ( "name", "label", "prefix", "description", "skip_index",
+            "skip_access", "skip_reset", "depth", "licenses", "digest",
+            "registers", "_index", "_addresses" )
+
     def __init__( self, name, label, prefix, description, skip_index,
             skip_access, skip_reset, depth, licenses ):
         self.name = name
@@ -25,62 +152,466 @@ class Registers( object ):
         self.skip_reset = skip_reset
         self.depth = depth
         self.licenses = licenses
+        # sha256 of the file this was parsed from.
+        self.digest = None
         self.registers = []
+        self._index = None
+        self._addresses = None
 
     def add_register( self, register ):
         self.registers.append( register )
         register.registers = self
+        self._index = None
+        self._addresses = None
+
+    def find( self, name ):
+        """Return the register whose short name, label or name is name,
+        ignoring case. Raise KeyError if there is none."""
+        if self._index is None:
+            self._index = name_index( self.registers,
+                    lambda r: ( r.short, r.label, r.name ) )
+        return self._index[name.lower()]
+
+    def address_index( self ):
+        """Return the AddressIndex of these registers."""
+        if self._addresses is None:
+            self._addresses = AddressIndex( [ self ] )
+        return self._addresses
+
+def format_c_number( value, unsigned=True ):
+    suffix = "ULL" if unsigned else ""
+    if value < 10 and value > -10:
+        return "%d%s" % (value, suffix)
+    else:
+        return "%#0x%s" % (value, suffix)
 
-def sympy_compare_lowBit( a, b ):
-    if sympy.simplify("(%s) > (%s)" % ( a.lowBit, b.lowBit )) == True:
-        return 1
-    if sympy.simplify("(%s) < (%s)" % ( a.lowBit, b.lowBit )) == True:
-        return -1
-    return 0
+class BitExpression( object ):
+    """An exact integer expression for a bit position, such as XLEN-5.
+
+    Bit positions are almost always affine in a handful of symbols, which we
+    represent natively as a constant plus a coefficient per symbol. Anything
+    else (e.g. the 2**length used for masks) falls back to sympy, which is
+    then only imported when it is really needed."""
+
+    __slots__ = ( "constant", "terms", "nonlinear" )
+
+    _token_re = re.compile( r"\s*(?:(0[xX][0-9a-fA-F]+|\d+)|([A-Za-z_]\w*)|(.))" )
+
+    def __init__( self, constant=0, terms=(), nonlinear=None ):
+        self.constant = constant
+        # Tuple of (symbol name, coefficient), sorted by name, no zero
+        # coefficients.
+        self.terms = tuple( sorted( (s, c) for s, c in terms if c ) )
+        # sympy expression, if this can't be represented as an affine
+        # expression.
+        self.nonlinear = nonlinear
+
+    @staticmethod
+    def parse( text ):
+        """Parse text into a BitExpression. Non-affine text is handed to
+        sympy."""
+        try:
+            return BitExpression.parse_affine( text )
+        except ValueError:
+            return BitExpression.from_sympy( simplify( text ) )
+
+    @staticmethod
+    def parse_affine( text ):
+        """Parse text into a BitExpression without using sympy. Raise
+        ValueError if text isn't an affine expression."""
+        tokens = []
+        for number, name, other in BitExpression._token_re.findall( text ):
+            if number:
+                tokens.append( BitExpression( int( number, 0 ) ) )
+            elif name:
+                tokens.append( BitExpression( 0, ((name, 1),) ) )
+            elif other.strip():
+                tokens.append( other )
+        tokens.append( None )
+        position = 0
+
+        def peek():
+            return tokens[position]
+
+        def take():
+            nonlocal position
+            position += 1
+            return tokens[position - 1]
+
+        def atom():
+            token = take()
+            if token == "(":
+                result = add()
+                if take() != ")":
+                    raise ValueError( "Unbalanced parentheses in %r" % text )
+                return result
+            if token == "-":
+                return -atom()
+            if token == "+":
+                return atom()
+            if isinstance( token, BitExpression ):
+                return token
+            raise ValueError( "Unexpected %r in %r" % ( token, text ) )
+
+        def mul():
+            result = atom()
+            while peek() == "*":
+                take()
+                other = atom()
+                if other.is_constant():
+                    result = result.scale( other.constant )
+                elif result.is_constant():
+                    result = other.scale( result.constant )
+                else:
+                    raise ValueError( "%r is not affine" % text )
+            return result
+
+        def add():
+            result = mul()
+            while peek() in ( "+", "-" ):
+                if take() == "+":
+                    result = result + mul()
+                else:
+                    result = result - mul()
+            return result
+
+        result = add()
+        if peek() is not None:
+            raise ValueError( "Unexpected %r in %r" % ( peek(), text ) )
+        return result
+
+    @staticmethod
+    def from_sympy( expression ):
+        expression = sympy.sympify( expression )
+        symbols = expression.free_symbols
+        try:
+            poly = sympy.Poly( expression, *symbols ) if symbols else None
+        except sympy.PolynomialError:
+            poly = None
+        if not symbols:
+            if expression.is_Integer:
+                return BitExpression( int( expression ) )
+        elif poly is not None and poly.total_degree() <= 1 and \
+                all( c.is_Integer for c in poly.coeffs() ):
+            terms = []
+            for s in symbols:
+                terms.append(( str( s ), int( poly.coeff_monomial( s ) ) ))
+            return BitExpression( int( poly.coeff_monomial( 1 ) ), terms )
+        return BitExpression( nonlinear=simplify( expression ) )
+
+    @staticmethod
+    def coerce( value ):
+        if isinstance( value, BitExpression ):
+            return value
+        if isinstance( value, int ):
+            return BitExpression( value )
+        if isinstance( value, str ):
+            return BitExpression.parse( value )
+        return BitExpression.from_sympy( value )
+
+    def to_sympy( self ):
+        if self.nonlinear is not None:
+            return self.nonlinear
+        return sympy.Integer( self.constant ) + sum(
+                c * sympy.Symbol( s ) for s, c in self.terms )
+
+    def _sympy_( self ):
+        return self.to_sympy()
+
+    def is_constant( self ):
+        return self.nonlinear is None and not self.terms
+
+    def symbols( self ):
+        if self.nonlinear is not None:
+            return frozenset( str( s ) for s in self.nonlinear.free_symbols )
+        return frozenset( s for s, c in self.terms )
+
+    def scale( self, factor ):
+        if self.nonlinear is not None:
+            return BitExpression.from_sympy( self.nonlinear * factor )
+        return BitExpression( self.constant * factor,
+                ((s, c * factor) for s, c in self.terms) )
+
+    def subs( self, values ):
+        """Substitute symbols with the values in the values dict."""
+        if self.nonlinear is not None:
+            return BitExpression.from_sympy( self.nonlinear.subs(
+                { sympy.Symbol( s ): v for s, v in values.items() } ) )
+        constant = self.constant
+        terms = []
+        for s, c in self.terms:
+            if s in values:
+                constant += c * values[s]
+            else:
+                terms.append(( s, c ))
+        return BitExpression( constant, terms )
+
+    def __add__( self, other ):
+        other = BitExpression.coerce( other )
+        if self.nonlinear is not None or other.nonlinear is not None:
+            return BitExpression.from_sympy( self.to_sympy() + other.to_sympy() )
+        terms = dict( self.terms )
+        for s, c in other.terms:
+            terms[s] = terms.get( s, 0 ) + c
+        return BitExpression( self.constant + other.constant, terms.items() )
+
+    __radd__ = __add__
+
+    def __neg__( self ):
+        return self.scale( -1 )
+
+    def __sub__( self, other ):
+        return self + -BitExpression.coerce( other )
+
+    def __rsub__( self, other ):
+        return BitExpression.coerce( other ) - self
+
+    def compare( self, other ):
+        """Return 1 if self is provably greater than other, -1 if it's
+        provably smaller, and 0 otherwise."""
+        delta = self - other
+        if delta.is_constant():
+            return ( delta.constant > 0 ) - ( delta.constant < 0 )
+        if delta.nonlinear is not None:
+            if simplify( delta.nonlinear > 0 ) == True:
+                return 1
+            if simplify( delta.nonlinear < 0 ) == True:
+                return -1
+        return 0
+
+    def _sign( self, other ):
+        delta = self - other
+        if not delta.is_constant():
+            raise TypeError( "cannot determine truth value of %s - (%s)" %
+                    ( self, other ) )
+        return ( delta.constant > 0 ) - ( delta.constant < 0 )
+
+    def __lt__( self, other ):
+        return self._sign( other ) < 0
+
+    def __le__( self, other ):
+        return self._sign( other ) <= 0
+
+    def __gt__( self, other ):
+        return self._sign( other ) > 0
+
+    def __ge__( self, other ):
+        return self._sign( other ) >= 0
+
+    def __eq__( self, other ):
+        if isinstance( other, int ):
+            other = BitExpression( other )
+        elif not isinstance( other, BitExpression ):
+            return NotImplemented
+        if self.nonlinear is not None or other.nonlinear is not None:
+            return simplify( self.to_sympy() - other.to_sympy() ) == 0
+        return self.constant == other.constant and self.terms == other.terms
+
+    def __hash__( self ):
+        if self.nonlinear is not None:
+            return hash( self.nonlinear )
+        if not self.terms:
+            return hash( self.constant )
+        return hash(( self.constant, self.terms ))
+
+    def __int__( self ):
+        if not self.is_constant():
+            raise TypeError( "Cannot convert symbolic %s to int" % self )
+        return self.constant
+
+    __index__ = __int__
+
+    def __rpow__( self, base ):
+        if self.is_constant():
+            return base ** self.constant
+        return sympy.Integer( base ) ** self.to_sympy()
+
+    def __str__( self ):
+        """Return the same string sympy would."""
+        if self.nonlinear is not None:
+            return str( self.nonlinear )
+        parts = []
+        for s, c in self.terms:
+            if c == 1:
+                parts.append(( 1, s ))
+            elif c == -1:
+                parts.append(( -1, s ))
+            else:
+                parts.append(( 1 if c > 0 else -1, "%d*%s" % ( abs( c ), s ) ))
+        if self.constant or not parts:
+            constant = ( 1 if self.constant >= 0 else -1, str( abs( self.constant ) ) )
+            if len( parts ) == 1 and parts[0][0] < 0 and constant[0] > 0:
+                parts.insert( 0, constant )
+            else:
+                parts.append( constant )
+        text = ( "-" if parts[0][0] < 0 else "" ) + parts[0][1]
+        for sign, part in parts[1:]:
+            text += ( " - " if sign < 0 else " + " ) + part
+        return text
+
+    def __repr__( self ):
+        return "BitExpression(%r)" % str( self )
+
+    def __reduce_ex__( self, protocol ):
+        # Keep bit positions shared when a model is loaded from the cache.
+        if self.nonlinear is None:
+            return shared_bits, ( self.constant, self.terms )
+        return super().__reduce_ex__( protocol )
+
+    def to_c( self, sym_to_c = lambda s: f"({s})", unsigned=True ):
+        """Return C source for this expression, formatted the same way
+        sympy_to_c() would."""
+        if self.nonlinear is not None:
+            return sympy_to_c( self.nonlinear, sym_to_c, unsigned )
+        args = []
+        if self.constant:
+            args.append( format_c_number( self.constant, unsigned ) )
+        for s, c in self.terms:
+            if c == 1:
+                args.append( sym_to_c( s ) )
+            else:
+                args.append( "(%s * %s)" % ( format_c_number( c, unsigned ),
+                    sym_to_c( s ) ) )
+        if not args:
+            return format_c_number( 0, unsigned )
+        if len( args ) == 1:
+            return args[0]
+        return "(" + " + ".join( reversed( args ) ) + ")"
+
+_shared_bits = {}
+def shared_bits( constant, terms=() ):
+    """Return the affine BitExpression constant + terms. Every caller gets
+    the same object for the same value, so the thousands of fields that start
+    at bit 0 (or end at XLEN-1) don't each hold their own copy."""
+    key = ( constant, tuple( terms ) )
+    expression = _shared_bits.get( key )
+    if expression is None:
+        expression = _shared_bits[key] = BitExpression( constant, terms )
+    return expression
+
+_bit_positions = {}
+def bit_position( text ):
+    """Return the BitExpression for the bit position text, as found in a
+    bits attribute."""
+    expression = _bit_positions.get( text )
+    if expression is None:
+        expression = BitExpression.parse( text )
+        if expression.nonlinear is None:
+            expression = shared_bits( expression.constant, expression.terms )
+        _bit_positions[text] = expression
+    return expression
+
+def intern( text ):
+    """Like sys.intern(), but pass None through. Used for attributes like
+    access and reset that only take a handful of distinct values."""
+    if text is None:
+        return None
+    return sys.intern( text )
+
+def max_expression( expressions ):
+    """Return the largest of expressions, raising TypeError if that can't be
+    determined."""
+    result = None
+    for e in expressions:
+        if result is None or e > result:
+            result = e
+    return result
+
+def name_index( items, names ):
+    """Return a dict mapping the lower case names( item ) of every item to the
+    item. The first item to use a name wins."""
+    index = {}
+    for item in items:
+        for name in names( item ):
+            if name:
+                index.setdefault( name.lower(), item )
+    return index
+
+def compare_lowBit( a, b ):
+    return a.lsb.compare( b.lsb )
 
 class Register( object ):
+    __slots__ = ( "name", "short", "description", "address", "sdesc",
+            "define", "digest", "diagram", "fields", "label", "registers",
+            "_index", "_layout", "_codecs" )
+
     def __init__( self, name, short, description, address, sdesc, define ):
         self.name = name
         self.short = short
         self.description = description
-        self.address = address
+        self.address = intern( address )
         self.sdesc = sdesc
         self.define = define
+        # sha256 of the XML this register was parsed from, if any.
+        self.digest = None
         # Allow user to override our auto-generated register diagram.
         self.diagram = None
         self.fields = []
 
         self.label = ( short or name ).lower() # TODO: replace spaces etc.
+        self.registers = None
+        self._index = None
+        self._layout = None
+        self._codecs = None
 
     def add_field( self, field ):
         self.fields.append( field )
-        self.fields.sort( key=cmp_to_key(sympy_compare_lowBit), reverse=True )
+        self.fields.sort( key=cmp_to_key(compare_lowBit), reverse=True )
         field.register = self
+        self._index = None
+        self._layout = None
+        self._codecs = None
+
+    def find_field( self, name ):
+        """Return the field called name, ignoring case. Raise KeyError if
+        there is none."""
+        if self._index is None:
+            self._index = name_index( self.fields, lambda f: ( f.name, ) )
+        return self._index[name.lower()]
 
     def check( self ):
         previous = None
         for f in self.fields:
             if not previous is None:
-                expression = "(%s) > (%s)" % ( previous, f.highBit )
-                result = sympy.simplify( expression )
-                if type( result ) == bool:
-                    assert result, "%s in %s of %s" % ( expression, f, self )
-
-                expression = "(%s) - (%s)" % ( previous, f.highBit )
-                delta = sympy.simplify( expression )
-                try:
-                    delta = int( delta )
-                    assert delta == 1, \
-                            "%s doesn't have all bits defined above %s (%s)" % ( self, f, expression )
-                except TypeError:
-                    pass
-            previous = f.lowBit
-        assert previous is None or int( previous ) == 0, \
+                delta = previous - f.msb
+                if delta.is_constant():
+                    assert delta.constant > 0, \
+                            "(%s) > (%s) in %s of %s" % ( previous, f.highBit, f, self )
+                    assert delta.constant == 1, \
+                            "%s doesn't have all bits defined above %s (%s)" % ( self, f, delta )
+            previous = f.lsb
+        assert previous is None or previous == 0, \
                 "%s isn't defined down to 0 (%r)" % ( self, previous )
 
+    def layout( self ):
+        """Return the BytefieldLayout of this register's diagram."""
+        if self._layout is None:
+            self._layout = BytefieldLayout( self.fields )
+        return self._layout
+
+    def codec( self, values=None ):
+        """Return the RegisterCodec of this register, with the symbols in the
+        values dict (e.g. { "XLEN": 64 }) replaced by their values."""
+        values = values or {}
+        key = tuple( sorted( ( s, values[s] ) for s in self.symbols()
+            if s in values ) )
+        if self._codecs is None:
+            self._codecs = {}
+        if key not in self._codecs:
+            self._codecs[key] = RegisterCodec( self, dict( key ) )
+        return self._codecs[key]
+
+    def dispatch( self ):
+        """Return the Dispatch that picks which of the registers at this
+        register's address describes a value read from it, or None."""
+        for d in self.registers.address_index().dispatches():
+            if d.register is self:
+                return d
+        return None
+
     def width( self ):
         if self.fields:
-            return Max(*(f.highBit for f in self.fields)) + 1
+            return max_expression(f.msb for f in self.fields) + 1
         else:
             return 0
 
@@ -88,7 +619,8 @@ class Register( object ):
         return self.name
 
     def symbols( self ):
-        return reduce(operator._or, map(lambda f: f.symbols(), self.fields))
+        return reduce(operator.or_, map(lambda f: f.symbols(), self.fields),
+                frozenset())
 
     def to_c_filter( self ):
         return self.define and not self.address is None
@@ -100,7 +632,8 @@ class Register( object ):
         return self.address_define_name() + "_ORDINAL"
 
     def sorted_fields( self ):
-        return sorted(filter(lambda f: f.to_c_filter(), self.fields), key=lambda f: f.lowBit)
+        """Return the fields that are described in C, sorted by sort_key."""
+        return sorted(filter(lambda f: f.to_c_filter(), self.fields), key=lambda f: f.sort_key)
 
     @staticmethod
     def c_field_list_type():
@@ -144,22 +677,69 @@ class Register( object ):
         return ("typedef struct {\n" +
                 "\tconst char *name;\n"
                 "\tstruct riscv_debug_reg_field_list_t (* const get_fields_head)(riscv_debug_reg_ctx_t context);\n" +
+                "\tunsigned int to_s_max_length; // The longest string riscv_debug_reg_to_s() can produce, excluding '\\0'\n" +
                 "} riscv_debug_reg_info_t;\n")
 
     def c_info( self, to_c ):
         return (f'.name = "{self.short or self.label}",\n' +
-                f'.get_fields_head = {list(self.c_field_getter_names())[0]}')
+                f'.get_fields_head = {list(self.c_field_getter_names())[0]},\n' +
+                f'.to_s_max_length = {self.c_to_s_max_length()}')
+
+    def c_to_s_max_length( self ):
+        """Return the longest string riscv_debug_reg_to_s() in
+        debug_reg_printer.c can produce for this register (not counting the
+        terminating '\\0'): "name=value {field=value ...}"."""
+        # The value passed in isn't limited to the width of the register.
+        length = len(self.short or self.label) + 1 + c_number_length(64)
+        fields = self.sorted_fields()
+        if fields:
+            length += len(" {") + len("}") + len(fields) - 1
+            length += sum(f.c_to_s_max_length() for f in fields)
+        return length
+
+    def c_field_table_name( self ):
+        return f"{self.address_define_name().lower()}_fields"
+
+    def c_field_table( self, to_bit ):
+        """Return a static const array describing the fields, in the same
+        order the getters would return them."""
+        fields = self.sorted_fields()
+        assert len(fields)
+        return (f"static const riscv_debug_reg_field_desc_t {self.c_field_table_name()}[] = {{\n\t" +
+                add_indent(",\n".join("{\n\t" + add_indent(f.c_desc(to_bit)) + "\n}"
+                    for f in fields)) +
+                "\n};\n")
+
+    @staticmethod
+    def c_table_info_type():
+        return ("typedef struct {\n" +
+                "\tconst char *name;\n" +
+                "\tconst riscv_debug_reg_field_desc_t *fields;\n" +
+                "\tunsigned int field_count;\n" +
+                "\tunsigned int to_s_max_length; // The longest string riscv_debug_reg_to_s() can produce, excluding '\\0'\n" +
+                "} riscv_debug_reg_info_t;\n")
+
+    def c_table_info( self ):
+        count = len(self.sorted_fields())
+        return (f'.name = "{self.short or self.label}",\n' +
+                f'.fields = {self.c_field_table_name() if count else "NULL"},\n' +
+                f'.field_count = {count},\n' +
+                f'.to_s_max_length = {self.c_to_s_max_length()}')
 
 class Value( object ):
+    __slots__ = ( "value", "range", "low", "high", "text", "tail", "name",
+            "duplicate" )
+
     def __init__( self, element ):
-        self.value = element.get( 'v' )
+        self.value = intern( element.get( 'v' ) )
         self.range = element.get( 'range' )
+        self.low = self.high = None
         if self.range:
-            self.low, self.high = self.range.split( ":" )
+            self.low, self.high = map( intern, self.range.split( ":" ) )
         self.text = (element.text or "").strip()
         self.tail = element.tail.strip()
         self.name = element.get( "name" )
-        self.duplicate = element.get( "duplicate" )
+        self.duplicate = intern( element.get( "duplicate" ) )
 
     def to_latex( self ):
         if not self.text:
@@ -187,16 +767,26 @@ class Value( object ):
         return result
 
 class Field( object ):
+    __slots__ = ( "name", "lowBit", "highBit", "lsb", "msb", "reset",
+            "access", "description", "define", "values", "register",
+            "sort_key" )
+
     def __init__( self, name, lowBit, highBit, reset, access, description,
             sdesc, define, values ):
         self.name = name
-        self.lowBit = lowBit
-        self.highBit = highBit
-        self.reset = reset
-        self.access = access
+        self.lowBit = intern( lowBit )
+        self.highBit = intern( highBit )
+        self.lsb = bit_position( self.lowBit )
+        self.msb = bit_position( self.highBit )
+        self.reset = intern( reset )
+        self.access = intern( access )
         self.description = description
         self.define = define
         self.values = values
+        self.register = None
+        # The order of fields in C output. Copies made by specialize_register()
+        # keep the key of the original field.
+        self.sort_key = self.lowBit
 
         name_counts = collections.Counter( v.name for v in values if not v.duplicate )
         assert all( v == 1 for v in name_counts.values() ), \
@@ -207,21 +797,21 @@ class Field( object ):
             "Duplicate field value in field %s" % self.name
 
     def length( self ):
-        return sympy.simplify( "1 + (%s) - (%s)" % ( self.highBit, self.lowBit ) )
+        return self.msb - self.lsb + 1
 
     def symbols( self ):
-        return sympy.simplify(self.lowBit).atoms(sympy.Symbol) | sympy.simplify(self.highBit).atoms(sympy.Symbol)
+        return self.lsb.symbols() | self.msb.symbols()
 
     def columnWidth( self ):
         """Return the width of the column in boxes."""
+        stats.count( "columnWidth" )
         offsetCharWidth = .26
         nameCharWidth = .33
-        xlen_symbol = sympy.symbols('XLEN')
         lengthCharWidth = .22
         try:
             # Pretend XLEN=32. This makes 32-bit registers with just a single
             # field be wide, while registers with XLEN-32 width be narrow.
-            length = int(self.length().subs(xlen_symbol, 32))
+            length = int(self.length().subs({'XLEN': 32}))
         except TypeError:
             length = 20
         if self.length() == 1:
@@ -258,7 +848,7 @@ class Field( object ):
         return self.name
 
     def mask(self):
-        return ((2 ** sympy.simplify(self.length())) - 1) * (2 ** sympy.simplify(self.lowBit))
+        return ((2 ** self.length()) - 1) * (2 ** self.lsb)
 
     def to_c_filter(self):
         return self.define
@@ -266,36 +856,164 @@ class Field( object ):
     def mask_define_name(self):
         return f"{self.register.address_define_name()}_{toCIdentifier( self.name ).upper()}"
 
+    def c_upper_field(self):
+        """If this is the low part of a field that was split in two (like
+        sizelo/sizehi, or hit0/hit1) and its values describe the combined
+        value, return the field holding the upper part."""
+        length = self.length()
+        if not length.is_constant() or \
+                all(int(v.value, 0) < 2**length for v in self.values if v.value is not None):
+            return None
+        for low, high in (("lo", "hi"), ("0", "1")):
+            if self.name.endswith(low):
+                try:
+                    return self.register.find_field(self.name[:-len(low)] + high)
+                except KeyError:
+                    pass
+        return None
+
+    def c_value_bits(self):
+        """Return how many bits the named values have, or None if that
+        depends on a symbol."""
+        length = self.length()
+        upper = self.c_upper_field()
+        if upper:
+            length = length + upper.length()
+        if not length.is_constant():
+            return None
+        return int(length)
+
+    def c_named_values(self):
+        """Return sorted ( value, name ) tuples for the values that get a name
+        in C. If a value has more than one name (see duplicate in the XML), the
+        first one wins."""
+        bits = self.c_value_bits()
+        names = {}
+        for v in self.values:
+            if v.value is None:
+                continue
+            value = int(v.value, 0)
+            if bits is None or value < 2**bits:
+                names.setdefault(value, v.name)
+        return sorted(names.items())
+
+    def c_values_dense(self):
+        """Return whether the values are described with an array indexed by
+        value, as opposed to a sorted list of the named values."""
+        bits = self.c_value_bits()
+        return bits is not None and 2**bits <= C_DENSE_VALUES_LIMIT
+
+    def c_to_s_max_length(self):
+        """Return the longest "name=value" debug_reg_printer.c can print for
+        this field."""
+        length = self.length()
+        bits = int(length) if length.is_constant() else None
+        names = [len(toCIdentifier(name)) for value, name in self.c_named_values()]
+        return len(self.name) + 1 + max([c_number_length(bits)] + names)
+
     def c_values_array_name(self):
-        return f"{self.mask_define_name().lower()}_values" if len(self.values) else "NULL"
+        if len(self.values) and self.c_values_dense():
+            return f"{self.mask_define_name().lower()}_values"
+        return "NULL"
+
+    def c_value_names_name(self):
+        return f"{self.mask_define_name().lower()}_value_names"
 
     def c_values_array_def(self):
         assert len(self.values)
 
+        if not self.c_values_dense():
+            return (f"static const riscv_debug_reg_value_name_t {self.c_value_names_name()}[] = {{\n\t" +
+                    ",\n\t".join(f'{{ {value}, "{toCIdentifier(name)}" }}'
+                                  for value, name in self.c_named_values()) +
+                    "\n};")
+
+        bits = self.c_value_bits()
+        named = set(value for value, name in self.c_named_values())
         # Remove whitespace from the names, so when they're displayed we can use
         # only ' ' as a separator.
-        arr_elem_def = (f'[{v.value}] = "{toCIdentifier(v.name)}"'
-                        for v in self.values if v.value is not None)
-
-        #WA for *lo & *hi splitted fields
-        if len(self.values) > 2**self.length():
-            return f"static const char *{self.c_values_array_name()}[{2**self.length()}] = {{}};"
-        return f"static const char *{self.c_values_array_name()}[{2**self.length()}] = {{\n\t" + ",\n\t".join(arr_elem_def) + "\n};"
+        arr_elem_def = []
+        for v in self.values:
+            if v.value is not None and int(v.value, 0) in named:
+                named.remove(int(v.value, 0))
+                arr_elem_def.append(f'[{v.value}] = "{toCIdentifier(v.name)}"')
+        return f"static const char *{self.c_values_array_name()}[{2**bits}] = {{\n\t" + ",\n\t".join(arr_elem_def) + "\n};"
+
+    def c_extra_info(self, to_c, bit_to_c=None):
+        """Return the initializers for the members of the field info that
+        are only needed for sparse or split values. bit_to_c formats
+        upper_lsb, and defaults to to_c."""
+        result = ""
+        if len(self.values) and not self.c_values_dense():
+            result += (f',\n.value_names = {self.c_value_names_name()}' +
+                       f',\n.value_name_count = {len(self.c_named_values())}')
+        upper = self.c_upper_field()
+        if upper:
+            result += (f',\n.upper_lsb = {(bit_to_c or to_c)(upper.lsb)}' +
+                       f',\n.upper_bits = {to_c(upper.length())}')
+        return result
 
     def offset_define_name(self):
         return self.mask_define_name() + "_OFFSET"
 
     @staticmethod
-    def c_info_type():
+    def c_value_name_type():
         return ("typedef struct {\n" +
+                "\tunsigned int value;\n" +
+                "\tconst char *name;\n" +
+                "} riscv_debug_reg_value_name_t;\n")
+
+    @staticmethod
+    def c_values_members():
+        return ("\tconst char **values; // If non-NULL, array of human-readable string for each possible value\n" +
+                "\tconst riscv_debug_reg_value_name_t *value_names; // If non-NULL, names of some values, sorted by value. Used when values would be too big.\n" +
+                "\tunsigned int value_name_count;\n")
+
+    @staticmethod
+    def c_info_type():
+        return (Field.c_value_name_type() +
+                "typedef struct {\n" +
                 "\tconst char *name;\n" +
                 "\tunsigned int lsb; // inclusive\n" +
                 "\tunsigned int msb; // inclusive\n" +
-                "\tconst char **values; // If non-NULL, array of human-readable string for each possible value\n" +
+                Field.c_values_members() +
+                "\t// If upper_bits is non-zero, the values are named for this field combined with\n" +
+                "\t// the upper_bits bits starting at upper_lsb, as the most significant bits.\n" +
+                "\tunsigned int upper_lsb;\n" +
+                "\tunsigned int upper_bits;\n" +
                 "} riscv_debug_reg_field_info_t;\n")
 
     def c_info( self, to_c ):
-        return f'.name = "{self.name}",\n.lsb = {to_c(self.lowBit)},\n.msb = {to_c(self.highBit)},\n.values = {self.c_values_array_name()}'
+        return f'.name = "{self.name}",\n.lsb = {to_c(self.lsb)},\n.msb = {to_c(self.msb)},\n.values = {self.c_values_array_name()}' + self.c_extra_info(to_c)
+
+    @staticmethod
+    def c_desc_type():
+        return ("typedef struct {\n" +
+                "\tconst char *name;\n" +
+                "\triscv_debug_reg_bit_t lsb; // inclusive\n" +
+                "\triscv_debug_reg_bit_t msb; // inclusive\n" +
+                Field.c_values_members() +
+                "\triscv_debug_reg_bit_t upper_lsb;\n" +
+                "\tunsigned int upper_bits;\n" +
+                "} riscv_debug_reg_field_desc_t;\n")
+
+    def c_desc( self, to_bit ):
+        return (f'.name = "{self.name}",\n.lsb = {to_bit(self.lsb)},\n.msb = {to_bit(self.msb)},\n.values = {self.c_values_array_name()}' +
+                self.c_extra_info(lambda e: e.to_c(unsigned=False), to_bit))
+
+def c_number_length( bits ):
+    """Return the most characters print_number() in debug_reg_printer.c uses
+    for a value of bits bits. None means any width the printer handles (up to
+    64 bits)."""
+    if bits is None or bits > 64:
+        bits = 64
+    if 2**bits - 1 <= 9:
+        return 1
+    return len("0x") + (bits + 3) // 4
+
+# Value names of fields with more possible values than this are described
+# with a sorted list instead of an array.
+C_DENSE_VALUES_LIMIT = 64
 
 def parse_bits( field ):
     """Return high, low (inclusive)."""
@@ -308,60 +1026,463 @@ def parse_bits( field ):
     else:
         assert False, text
 
-def parse_spdx( path ):
-    with open( path ) as f:
-        data = f.read(4096)
-        return set(re.findall(r"SPDX-License-Identifier:\s*(.+?)\s*(?:-->.*)?$", data, re.MULTILINE))
+def file_digest( path ):
+    h = hashlib.sha256()
+    with open( path, "rb" ) as f:
+        for chunk in iter( lambda: f.read( XML_CHUNK_SIZE ), b"" ):
+            h.update( chunk )
+    return h.hexdigest()
 
-def parse_xml( path ):
-    licenses = parse_spdx(path)
-    e = xml.etree.ElementTree.parse( path ).getroot()
+def element_text( e ):
     if e.text:
-        description = e.text.strip()
-    else:
-        description = ""
-    registers = Registers( e.get( 'name' ), e.get( 'label' ),
-            e.get( 'prefix' ), description,
-            int( e.get( 'skip_index', 0 ) ),
-            int( e.get( 'skip_access', 0 ) ),
-            int( e.get( 'skip_reset', 0 ) ),
-            int( e.get( 'depth', 1 )),
-            licenses)
-    for r in e.findall( 'register' ):
-        name = r.get( 'name' )
-        short = r.get( 'short' )
-        if r.text:
-            description = r.text.strip()
+        return e.text.strip()
+    return ""
+
+def parse_register( r ):
+    """Return the checked Register described by the <register> element r."""
+    register = Register( r.get( 'name' ), r.get( 'short' ), element_text( r ),
+            r.get( 'address' ), r.get( 'sdesc' ),
+            int( r.get( 'define', '1' ) ) )
+
+    for f in r.findall( 'field' ):
+        highBit, lowBit = parse_bits( f )
+        if f.get( 'name' ) == '0':
+            define = int( f.get( 'define', '0' ) )
         else:
-            description = ""
-        register = Register( name, short, description,
-                r.get( 'address' ), r.get( 'sdesc' ),
-                int( r.get( 'define', '1' ) ) )
-
-        fields = r.findall( 'field' )
-        for f in fields:
-            highBit, lowBit = parse_bits( f )
-            if f.text:
-                description = f.text.strip()
-            else:
-                description = ""
-            if f.get( 'name' ) == '0':
-                define = int( f.get( 'define', '0' ) )
-            else:
-                define = int( f.get( 'define', '1' ) )
-            values = [ Value( v ) for v in f.findall( 'value' ) ]
-            field = Field( f.get( 'name' ), lowBit, highBit, f.get( 'reset' ),
-                    f.get( 'access' ), description, f.get( 'sdesc' ),
-                    define, values )
-            register.add_field( field )
+            define = int( f.get( 'define', '1' ) )
+        values = [ Value( v ) for v in f.findall( 'value' ) ]
+        field = Field( f.get( 'name' ), lowBit, highBit, f.get( 'reset' ),
+                f.get( 'access' ), element_text( f ), f.get( 'sdesc' ),
+                define, values )
+        register.add_field( field )
 
-        for diagram in r.findall( 'diagram' ):
-            register.diagram = diagram.text.strip()
+    for diagram in r.findall( 'diagram' ):
+        register.diagram = diagram.text.strip()
 
+    with stats.timer( "check" ):
         register.check()
-        registers.add_register( register )
+    stats.count( "registers" )
+    stats.count( "fields", len( register.fields ) )
+    # Whether the text after </register> has been read yet depends on where
+    # the parser's input was split, so leave it out of the digest.
+    r.tail = None
+    register.digest = hashlib.sha256(
+            xml.etree.ElementTree.tostring( r ) ).hexdigest()
+    return register
+
+XML_CHUNK_SIZE = 1 << 16
+
+class XmlReader( object ):
+    """Read a register description file incrementally. Iterating over this
+    yields each Register as soon as its closing tag has been read, after
+    which its elements are thrown away, so memory use is bounded by the
+    largest register rather than by the whole file.
+
+    self.registers is the Registers for the file (with no registers added),
+    available once the first register has been yielded. self.licenses and
+    self.digest are only complete once every register has been read."""
+    def __init__( self, path ):
+        self.path = path
+        self.registers = None
+        self.licenses = set()
+        self.digest = None
+
+    def header( self, e ):
+        return Registers( e.get( 'name' ), e.get( 'label' ),
+                e.get( 'prefix' ), element_text( e ),
+                int( e.get( 'skip_index', 0 ) ),
+                int( e.get( 'skip_access', 0 ) ),
+                int( e.get( 'skip_reset', 0 ) ),
+                int( e.get( 'depth', 1 )),
+                self.licenses )
+
+    def __iter__( self ):
+        parser = xml.etree.ElementTree.XMLPullParser(
+                events=( "start", "end", "comment" ) )
+        h = hashlib.sha256()
+        root = None
+        depth = 0
+        with open( self.path, "rb" ) as f:
+            while True:
+                chunk = f.read( XML_CHUNK_SIZE )
+                if chunk:
+                    h.update( chunk )
+                    parser.feed( chunk )
+                else:
+                    parser.close()
+                for event, e in parser.read_events():
+                    if event == "comment":
+                        self.licenses.update( re.findall(
+                            r"SPDX-License-Identifier:\s*(.+?)\s*$", e.text,
+                            re.MULTILINE ) )
+                    elif event == "start":
+                        depth += 1
+                        if depth == 1:
+                            root = e
+                        elif depth == 2 and self.registers is None:
+                            # The root's text is complete once its first
+                            # child starts.
+                            self.registers = self.header( root )
+                    else:
+                        depth -= 1
+                        if depth == 0 and self.registers is None:
+                            self.registers = self.header( root )
+                        elif depth == 1:
+                            root.remove( e )
+                            if e.tag == 'register':
+                                yield parse_register( e )
+                if not chunk:
+                    break
+        self.digest = h.hexdigest()
+
+@timed( "parse_xml" )
+def parse_xml( path ):
+    reader = XmlReader( path )
+    for register in reader:
+        reader.registers.add_register( register )
+    registers = reader.registers
+    registers.digest = reader.digest
+    return registers
+
+class RegisterStream( object ):
+    """The registers of a Registers returned by stream_xml(), parsed only as
+    they are iterated over. That can only happen once."""
+    def __init__( self, path, registers, iterator ):
+        self.path = path
+        self.registers = registers
+        self.iterator = iterator
+        self.started = False
+
+    def __iter__( self ):
+        if self.started:
+            raise RuntimeError( "Registers streamed from %s can only be read "
+                    "once. This output needs all of them at once, so it can't "
+                    "be streamed." % self.path )
+        self.started = True
+        for register in self.iterator:
+            register.registers = self.registers
+            yield register
+
+def stream_xml( path ):
+    """Like parse_xml(), but registers.registers is a RegisterStream, so
+    each register is only parsed when a backend gets to it, and is freed once
+    the backend is done with it. This works for backends that look at each
+    register once, in order, such as write_adoc(), write_adoc_definitions(),
+    write_definitions() and write_cheader(). registers.licenses is only
+    complete once all the registers have been read."""
+    reader = XmlReader( path )
+    iterator = iter( reader )
+    first = next( iterator, None )
+    registers = reader.registers
+    # Backends write the digest before they have seen the whole file, so
+    # hash it separately.
+    registers.digest = file_digest( path )
+    if first is not None:
+        iterator = itertools.chain( [ first ], iterator )
+    registers.registers = RegisterStream( path, registers, iterator )
+    return registers
+
+def specialize_register( register, values ):
+    """Return a copy of register, with the symbols in the values dict
+    replaced by their values."""
+    copy = Register( register.name, register.short, register.description,
+            register.address, register.sdesc, register.define )
+    copy.diagram = register.diagram
+    for f in register.fields:
+        lowBit, highBit = f.lowBit, f.highBit
+        if f.lsb.symbols() & values.keys():
+            lowBit = str( f.lsb.subs( values ) )
+        if f.msb.symbols() & values.keys():
+            highBit = str( f.msb.subs( values ) )
+        field = Field( f.name, lowBit, highBit, f.reset, f.access,
+            f.description, None, f.define, f.values )
+        field.sort_key = f.sort_key
+        copy.add_field( field )
+    copy.check()
+    return copy
+
+def specialize( registers, values ):
+    """Return a copy of registers with the symbols in the values dict (e.g.
+    { "XLEN": 64 }) replaced by their values, so that every bit position that
+    only depends on those symbols is a constant. The copy of each Register
+    has no digest, so it is never confused with the original in a
+    FragmentCache."""
+    copy = Registers( registers.name, registers.label, registers.prefix,
+            registers.description, registers.skip_index,
+            registers.skip_access, registers.skip_reset, registers.depth,
+            registers.licenses )
+    copy.digest = registers.digest
+    if isinstance( registers.registers, RegisterStream ):
+        copy.registers = RegisterStream( registers.registers.path, copy,
+                ( specialize_register( r, values ) for r in registers.registers ) )
+        return copy
+    for r in registers.registers:
+        copy.add_register( specialize_register( r, values ) )
+    return copy
+
+class RegisterCodec( object ):
+    """Decodes NumPy arrays of raw values of one register into structured
+    arrays with a column per field, and encodes such columns back into raw
+    values. Every bit position is evaluated once, when the codec is made, so
+    this is only possible once the values of all the symbols they depend on
+    are known. Reserved fields (see Field.define) are left out."""
+    __slots__ = ( "register", "names", "shifts", "masks", "dtype" )
+
+    def __init__( self, register, values ):
+        self.register = register
+        self.names = []
+        self.shifts = []
+        self.masks = []
+        types = []
+        for f in register.fields:
+            if not f.define:
+                continue
+            lsb = f.lsb.subs( values )
+            msb = f.msb.subs( values )
+            if not lsb.is_constant() or not msb.is_constant():
+                raise ValueError( "Field %s of %s depends on %s." % ( f, register,
+                    ", ".join( sorted( lsb.symbols() | msb.symbols() ) ) ) )
+            lsb, msb = int( lsb ), int( msb )
+            if msb < lsb or msb > 63:
+                raise ValueError( "Field %s of %s is bits %d:%d." % ( f,
+                    register, msb, lsb ) )
+            length = msb - lsb + 1
+            self.names.append( f.name )
+            self.shifts.append( numpy.uint64( lsb ) )
+            self.masks.append( numpy.uint64( 2 ** length - 1 ) )
+            types.append( numpy.min_scalar_type( 2 ** length - 1 ) )
+        self.dtype = numpy.dtype( list( zip( self.names, types ) ) )
+
+    def decode( self, raw ):
+        """Return a structured array with the fields of each value in raw."""
+        raw = numpy.asarray( raw, dtype=numpy.uint64 )
+        result = numpy.empty( raw.shape, dtype=self.dtype )
+        column = numpy.empty_like( raw )
+        for name, shift, mask in zip( self.names, self.shifts, self.masks ):
+            numpy.right_shift( raw, shift, out=column )
+            numpy.bitwise_and( column, mask, out=column )
+            result[name] = column
+        return result
+
+    def encode( self, fields ):
+        """Return the raw values of fields, which is a structured array like
+        the ones decode() returns, or a dict of field name to array. Fields
+        that are missing are 0. Raise ValueError if a field doesn't fit."""
+        if isinstance( fields, numpy.ndarray ):
+            fields = { name: fields[name] for name in fields.dtype.names }
+        unknown = set( fields ) - set( self.names )
+        if unknown:
+            raise ValueError( "%s has no field %s." % ( self.register,
+                ", ".join( sorted( unknown ) ) ) )
+        shape = numpy.broadcast_shapes( *( numpy.shape( c )
+            for c in fields.values() ) )
+        raw = numpy.zeros( shape, dtype=numpy.uint64 )
+        for name, shift, mask in zip( self.names, self.shifts, self.masks ):
+            if name not in fields:
+                continue
+            column = numpy.asarray( fields[name] )
+            if column.dtype.kind == "i" and ( column < 0 ).any():
+                raise ValueError( "%s of %s is negative." % ( name, self.register ) )
+            if ( column > mask ).any():
+                raise ValueError( "%s of %s is more than %d bits." % ( name,
+                    self.register, int( mask ).bit_length() ) )
+            column = column.astype( numpy.uint64 )
+            numpy.left_shift( column, shift, out=column )
+            raw |= column
+        return raw
+
+class Dispatch( object ):
+    """Registers that share an address, where the value of a field of one of
+    them (the discriminator) tells which register describes a value. For
+    instance tdata1.type tells whether the value at 0x7a1 is an mcontrol,
+    icount, etc."""
+    __slots__ = ( "register", "field", "variants" )
+
+    def __init__( self, register, field, variants ):
+        self.register = register
+        self.field = field
+        # [( field value, Register )], sorted by value.
+        self.variants = variants
+
+    def variant( self, field_value ):
+        """Return the register describing values whose discriminator is
+        field_value. That is self.register if no other register does."""
+        for value, r in self.variants:
+            if value == field_value:
+                return r
+        return self.register
+
+    def codec( self, values=None ):
+        """Return a DispatchCodec, with the symbols in the values dict
+        replaced by their values."""
+        return DispatchCodec( self, values or {} )
+
+class DispatchCodec( object ):
+    """Decodes NumPy arrays of raw values read from the address of a
+    Dispatch. Each value is decoded with the register its discriminator
+    selects, using a table indexed by the discriminator. The result has a
+    "variant" column holding the index of that register in self.registers,
+    and a column for every field of any of the registers. Fields that the
+    selected register doesn't have are 0."""
+    __slots__ = ( "registers", "codecs", "shift", "mask", "table", "dtype" )
+
+    def __init__( self, dispatch, values ):
+        self.registers = [ dispatch.register ] + [ r for value, r in dispatch.variants ]
+        self.codecs = [ r.codec( values ) for r in self.registers ]
+        i = self.codecs[0].names.index( dispatch.field.name )
+        self.shift = self.codecs[0].shifts[i]
+        self.mask = self.codecs[0].masks[i]
+        self.table = numpy.zeros( int( self.mask ) + 1, dtype=numpy.uint8 )
+        for index, ( value, r ) in enumerate( dispatch.variants, 1 ):
+            self.table[value] = index
+        columns = { "variant": numpy.dtype( numpy.uint8 ) }
+        for codec in self.codecs:
+            for name in codec.names:
+                column = codec.dtype[name]
+                if name not in columns or column.itemsize > columns[name].itemsize:
+                    columns[name] = column
+        self.dtype = numpy.dtype( list( columns.items() ) )
+
+    def decode( self, raw ):
+        """Return a structured array with the variant and fields of each value
+        in raw."""
+        raw = numpy.asarray( raw, dtype=numpy.uint64 )
+        variant = self.table[ ( raw >> self.shift ) & self.mask ]
+        result = numpy.zeros( raw.shape, dtype=self.dtype )
+        result["variant"] = variant
+        for index, codec in enumerate( self.codecs ):
+            selected = numpy.flatnonzero( variant == index )
+            if not len( selected ):
+                continue
+            decoded = codec.decode( raw.reshape( -1 )[selected] )
+            flat = result.reshape( -1 )
+            for name in codec.names:
+                flat[name][selected] = decoded[name]
+        return result
+
+class Capture( object ):
+    """A file of fixed size binary records, each holding the value of one
+    register (such as the JTAG dmi register) as an unsigned integer. The
+    record size is the smallest integer the register fits in, unless given.
+    The file is memory-mapped rather than read, and fields are extracted with
+    the register's RegisterCodec, so even captures much bigger than memory
+    can be decoded and searched a chunk at a time."""
+    def __init__( self, path, register, values=None, record_size=None,
+            byteorder="<", offset=0 ):
+        values = values or {}
+        self.codec = register.codec( values )
+        msbs = [ f.msb.subs( values ) for f in register.fields ]
+        if not all( msb.is_constant() for msb in msbs ):
+            raise ValueError( "The width of %s depends on %s." % ( register,
+                ", ".join( sorted( reduce( operator.or_,
+                    ( msb.symbols() for msb in msbs ) ) ) ) ) )
+        width = max( [ int( msb ) + 1 for msb in msbs ] + [ 0 ] )
+        if record_size is None:
+            record_size = next( ( size for size in ( 1, 2, 4, 8 )
+                if size * 8 >= width ), None )
+        if record_size not in ( 1, 2, 4, 8 ) or record_size * 8 < width:
+            raise ValueError( "%d bit %s doesn't fit in %s byte records." % (
+                width, register, record_size or "8" ) )
+        self.dtype = numpy.dtype( "%su%d" % ( byteorder, record_size ) )
+        self.raw = numpy.memmap( path, dtype=self.dtype, mode="r",
+                offset=offset )
+
+    def __len__( self ):
+        return len( self.raw )
+
+    def field( self, name, start=0, stop=None ):
+        """Return the values of one field in records start to stop."""
+        i = self.codec.names.index( name )
+        return ( self.raw[start:stop].astype( numpy.uint64, copy=False ) >>
+                self.codec.shifts[i] ) & self.codec.masks[i]
+
+    def decode( self, start=0, stop=None ):
+        """Return the fields of records start to stop as a structured
+        array."""
+        return self.codec.decode( self.raw[start:stop] )
+
+    def chunks( self, size=1 << 20 ):
+        """Yield ( index of the first record, decoded fields ) for every size
+        records."""
+        for start in range( 0, len( self.raw ), size ):
+            yield start, self.decode( start, start + size )
+
+    def where( self, condition, size=1 << 20 ):
+        """Return the indices of the records for which condition is true.
+        condition is called with the decoded fields of size records at a
+        time, and returns a boolean array."""
+        return numpy.concatenate( [ start + numpy.flatnonzero( condition( fields ) )
+            for start, fields in self.chunks( size ) ] +
+            [ numpy.zeros( 0, dtype=numpy.intp ) ] )
+
+def generator_digest():
+    """Return a digest of this script, so cached models are invalidated
+    whenever the code that builds them changes."""
+    global _generator_digest
+    if _generator_digest is None:
+        with open( os.path.abspath( __file__ ), "rb" ) as f:
+            _generator_digest = hashlib.sha256( f.read() ).digest()
+    return _generator_digest
+_generator_digest = None
+
+class ModelUnpickler( pickle.Unpickler ):
+    """Load pickled models into this module, whether the pickle was written
+    by the script (as __main__) or by a program that imported us."""
+    def find_class( self, module, name ):
+        if module in ( "__main__", "registers" ) and name in globals():
+            return globals()[name]
+        return super().find_class( module, name )
+
+def load_cached( path, cache_dir ):
+    """Like parse_xml(), but reuse the checked model from cache_dir if this
+    exact XML was parsed by this exact version of the script before."""
+    with open( path, "rb" ) as f:
+        data = f.read()
+    key = hashlib.sha256( generator_digest() + data ).hexdigest()
+    cache_path = os.path.join( cache_dir, key + ".pickle" )
+    try:
+        with open( cache_path, "rb" ) as f:
+            registers = ModelUnpickler( f ).load()
+            stats.count( "model_cache_hits" )
+            return registers
+    except FileNotFoundError:
+        pass
+    except Exception as e:
+        # A corrupt entry, or one pickled by a different module name (e.g.
+        # __main__ vs. registers). Just replace it.
+        print( "Ignoring cache entry %s: %s" % ( cache_path, e ), file=sys.stderr )
+
+    stats.count( "model_cache_misses" )
+    registers = parse_xml( path )
+    os.makedirs( cache_dir, exist_ok=True )
+    fd, tmp_path = tempfile.mkstemp( dir=cache_dir, suffix=".tmp" )
+    try:
+        with os.fdopen( fd, "wb" ) as f:
+            pickle.dump( registers, f, pickle.HIGHEST_PROTOCOL )
+        os.replace( tmp_path, cache_path )
+    except BaseException:
+        os.unlink( tmp_path )
+        raise
     return registers
 
+def capture_write( function, *args ):
+    """Call function( fd, *args ), and return what it wrote to fd."""
+    fd = io.StringIO()
+    function( fd, *args )
+    return fd.getvalue()
+
+def load( path, cache_dir=None ):
+    """Return the checked Registers described by the XML file at path. If
+    cache_dir is given, reuse a model cached there by an earlier call."""
+    if cache_dir:
+        return load_cached( path, cache_dir )
+    return parse_xml( path )
+
+def render( writer, *args ):
+    """Return the output of a backend such as write_adoc() or
+    write_cheader() as a string."""
+    return capture_write( writer, *args )
+
 def toLatexIdentifier( *args ):
     replacements = (
             ( '/', '' ),
@@ -446,8 +1567,8 @@ def write_adoc_definitions( fd, registers ):
 class Macro:
     def __init__(self, name, expressionText):
         self.name = name
-        self.expression = sympy.simplify(expressionText)
-        self.atoms = self.expression.atoms(sympy.Symbol)
+        self.expression = BitExpression.coerce(expressionText)
+        self.atoms = sorted(self.expression.symbols())
 
     def prototype(self):
         if self.atoms:
@@ -463,6 +1584,8 @@ def sympy_to_c(expression, sym_to_c = lambda s: f"({s})", unsigned=True):
     stc = lambda x : sympy_to_c(x, sym_to_c, unsigned)
     if isinstance(expression, str):
         return expression
+    if isinstance(expression, BitExpression):
+        return expression.to_c(sym_to_c, unsigned)
     if isinstance(expression, sympy.Number):
         suffix = "ULL" if unsigned else ""
         if (expression < 10 and expression > -10):
@@ -479,7 +1602,7 @@ def sympy_to_c(expression, sym_to_c = lambda s: f"({s})", unsigned=True):
         base, exponent = expression.as_base_exp()
         assert base == 2, "Power must have base of two, not %r" % base
         return "(1ULL << %s)" % stc(exponent)
-    elif isinstance(expression, Max):
+    elif isinstance(expression, sympy.Max):
         args = list(map(stc, expression.args))
         def c_max(args):
             if len(args) == 1:
@@ -540,13 +1663,14 @@ def write_cheader( fd, registers ):
             fd.write( " */\n" )
             continue
         if counted[name] == 1:
-            value = sympy_to_c(value)
+            with stats.timer( "sympy_to_c" ):
+                value = sympy_to_c(value)
             fd.write( "#define %-35s %s\n" % ( name, value ) )
 
 def add_indent( s ):
     return s.replace("\n", "\n\t")
 
-def print_cgetters( registers_list, fd_h, fd_c):
+def print_cgetters( registers_list, fd_h, fd_c, tables=False ):
     all_regs = [r for registers in registers_list for r in registers.registers if r.to_c_filter and len(r.fields)]
     fd_h.write("enum riscv_debug_reg_ordinal {\n\t" +
                ",\n\t".join(
@@ -558,18 +1682,30 @@ def print_cgetters( registers_list, fd_h, fd_c):
     all_symbols = reduce(
             operator.or_,
             (f.symbols()
-             for r in all_regs for f in r.fields if f.to_c_filter()))
+             for r in all_regs for f in r.fields if f.to_c_filter()),
+            frozenset())
 
     gen_sym_struct = lambda s: "struct {\n\t\tunsigned int value; int is_set;\n\t} " + s
-    fd_h.write("typedef struct {\n\t" +
-               ";\n\t".join(gen_sym_struct(s) for s in sorted((map(lambda sym: str(sym), all_symbols)))) +
-               ";\n} riscv_debug_reg_ctx_t;\n\n")
+    if all_symbols:
+        fd_h.write("typedef struct {\n\t" +
+                   ";\n\t".join(gen_sym_struct(s) for s in sorted((map(lambda sym: str(sym), all_symbols)))) +
+                   ";\n} riscv_debug_reg_ctx_t;\n\n")
+    else:
+        # Every bit position is a constant (e.g. thanks to --define), but
+        # keep the type so the API doesn't change.
+        fd_h.write("typedef struct {\n\tchar unused;\n} riscv_debug_reg_ctx_t;\n\n")
 
     fd_h.write(Field.c_info_type())
+    if tables:
+        print_cfield_tables( all_regs, sorted( all_symbols ), fd_h, fd_c )
+        print_cto_s_max_length( all_regs, fd_h )
+        print_cordinal_lookups( registers_list, all_regs, fd_h, fd_c )
+        print_cdispatch( registers_list, all_regs, fd_h, fd_c )
+        return
     fd_h.write(Register.c_field_list_type())
     fd_h.write(Register.c_info_type())
 
-    to_c = lambda string: sympy_to_c(sympy.simplify(string), lambda s: f"context.{s}.value", False)
+    to_c = lambda expression: expression.to_c(lambda s: f"context.{s}.value", False)
     is_valid = lambda s: f"context.{s}.is_set"
 
     for r in all_regs:
@@ -590,6 +1726,189 @@ def print_cgetters( registers_list, fd_h, fd_c):
                           "return debug_reg_info[reg_ordinal];") +
                "\n}\n")
 
+    print_cto_s_max_length( all_regs, fd_h )
+    print_cordinal_lookups( registers_list, all_regs, fd_h, fd_c )
+    print_cdispatch( registers_list, all_regs, fd_h, fd_c )
+
+def print_cto_s_max_length( all_regs, fd_h ):
+    fd_h.write("/* The longest string riscv_debug_reg_to_s() can produce for any register,\n" +
+               " * excluding '\\0'. */\n")
+    fd_h.write("#define RISCV_DEBUG_REG_TO_S_MAX_LENGTH %d\n" %
+            max([r.c_to_s_max_length() for r in all_regs] + [0]))
+
+def c_symbol_name( symbol ):
+    return "RISCV_DEBUG_REG_SYMBOL_" + toCIdentifier( symbol ).upper()
+
+def c_bit( expression ):
+    """Return a riscv_debug_reg_bit_t initializer for the bit position
+    expression, which may add at most one symbol to a constant."""
+    if expression.nonlinear is not None or len( expression.terms ) > 1 or \
+            any( c != 1 for s, c in expression.terms ):
+        raise ValueError( "%s can't be described in a field table" % expression )
+    constant = format_c_number( expression.constant, False )
+    if not expression.terms:
+        return f"{{ .constant = {constant} }}"
+    return f"{{ .constant = {constant}, .symbol = {c_symbol_name( expression.terms[0][0] )} }}"
+
+def print_cordinal_lookups( registers_list, all_regs, fd_h, fd_c ):
+    """Write a function for each address space (DM_, CSR_, DTM_, ...) that
+    finds the ordinal of the register at an address, so decoders that only
+    see a bus address don't need their own mapping. Dense address spaces get
+    a table, sparse ones a switch. If several registers share an address
+    (like the tdata1 aliases), the first one described wins."""
+    with_ordinals = set( map( id, all_regs ) )
+    index = AddressIndex( registers_list )
+    fd_h.write("/* Set *ordinal to the ordinal of the register at address, and return\n" +
+               " * 1. Return 0 if there is no such register. */\n")
+    for space, addresses in index.spaces.items():
+        found = []
+        for key in sorted( addresses ):
+            registers = [ r for r in addresses[key] if id( r ) in with_ordinals ]
+            if key[0] == 0 and registers:
+                found.append(( key[1], registers[0] ))
+        if not found:
+            continue
+
+        name = toCIdentifier( space ).lower().strip( "_" )
+        lookup_func = (f"int get_riscv_debug_reg_ordinal_{name}(unsigned int address, " +
+                       "enum riscv_debug_reg_ordinal *ordinal)")
+        fd_h.write(lookup_func + ";\n")
+        base = found[0][0]
+        span = found[-1][0] - base + 1
+        if span <= 4 * len( found ):
+            # Entries hold the ordinal + 1, so that 0 means no register.
+            body = ("static const unsigned short ordinals[] = {\n\t" +
+                    add_indent("\n".join(f"[{address:#x} - {base:#x}] = {r.ordinal_name()} + 1,"
+                                         for address, r in found)) +
+                    "\n};\n" +
+                    f"if (address < {base:#x} || address - {base:#x} >= {span:#x} ||\n" +
+                    f"\t\t!ordinals[address - {base:#x}])\n" +
+                    "\treturn 0;\n" +
+                    f"*ordinal = ordinals[address - {base:#x}] - 1;\n" +
+                    "return 1;")
+        else:
+            body = ("switch (address) {\n" +
+                    "".join(f"case {address:#x}:\n" +
+                            f"\t*ordinal = {r.ordinal_name()};\n" +
+                            "\treturn 1;\n"
+                            for address, r in found) +
+                    "}\n" +
+                    "return 0;")
+        fd_c.write("\n" + lookup_func + "\n" +
+                   "{\n\t" + add_indent(body) + "\n}\n")
+
+def print_cdispatch( registers_list, all_regs, fd_h, fd_c ):
+    """Write riscv_debug_reg_dispatch(), which uses a table indexed by the
+    discriminator of each Dispatch (like tdata1.type) to find the register
+    describing a value."""
+    with_ordinals = set( map( id, all_regs ) )
+    dispatches = [ d for d in AddressIndex( registers_list ).dispatches()
+            if id( d.register ) in with_ordinals ]
+    dispatch_func = ("enum riscv_debug_reg_ordinal riscv_debug_reg_dispatch(" +
+                     "enum riscv_debug_reg_ordinal reg_ordinal,\n" +
+                     "\t\triscv_debug_reg_ctx_t context, uint64_t value)")
+    fd_h.write("/* Return the ordinal of the register that describes value, which was read\n" +
+               " * from the register with reg_ordinal. That is reg_ordinal, unless a field\n" +
+               " * of the value tells which of the registers at its address applies, like\n" +
+               " * tdata1.type does for mcontrol, icount, etc. */\n")
+    fd_h.write(dispatch_func + ";\n")
+    to_c = lambda expression: expression.to_c(lambda s: f"context.{s}.value", False)
+    cases = []
+    for d in dispatches:
+        f = d.field
+        length = int(f.length())
+        name = toCIdentifier(f.name).lower()
+        # Entries hold the ordinal + 1, so that 0 means reg_ordinal.
+        cases.append(f"case {d.register.ordinal_name()}: {{\n\t" +
+                add_indent(f"static const unsigned short ordinals[{2**length}] = {{\n\t" +
+                           add_indent("\n".join(f"[{value}] = {r.ordinal_name()} + 1,"
+                                                 for value, r in d.variants)) +
+                           "\n};\n" +
+                           "".join(f"assert(context.{s}.is_set);\n" for s in sorted(f.symbols())) +
+                           f"const uint64_t {name} = (value >> {to_c(f.lsb)}) & " +
+                           f"{format_c_number(2**length - 1)};\n" +
+                           f"if (ordinals[{name}])\n" +
+                           f"\treturn ordinals[{name}] - 1;\n" +
+                           "break;") +
+                "\n}\n")
+    body = ("switch (reg_ordinal) {\n" +
+            "".join(cases) +
+            "default:\n" +
+            "\tbreak;\n" +
+            "}\n" +
+            "return reg_ordinal;")
+    if not dispatches:
+        body = "(void)context;\n(void)value;\nreturn reg_ordinal;"
+    fd_c.write("\n" + dispatch_func + "\n" +
+               "{\n\t" + add_indent(body) + "\n}\n")
+
+def print_cfield_tables( all_regs, symbols, fd_h, fd_c ):
+    """The rest of print_cgetters(), describing the fields of each register
+    with a static const array instead of a chain of getter functions. Bit
+    positions that depend on the context are resolved by
+    riscv_debug_reg_resolve_field()."""
+    fd_h.write("#define RISCV_DEBUG_REG_FIELD_TABLES\n")
+    fd_h.write("enum riscv_debug_reg_symbol {\n\t" +
+               ",\n\t".join(["RISCV_DEBUG_REG_SYMBOL_NONE"] +
+                   [c_symbol_name(s) for s in symbols]) +
+               "\n};\n")
+    fd_h.write("typedef struct {\n" +
+               "\tint constant;\n" +
+               "\tenum riscv_debug_reg_symbol symbol; // Added to constant\n" +
+               "} riscv_debug_reg_bit_t;\n")
+    fd_h.write(Field.c_desc_type())
+    fd_h.write(Register.c_table_info_type())
+
+    for r in all_regs:
+        for f in r.fields:
+            if f.to_c_filter() and len(f.values):
+                fd_c.write(f.c_values_array_def() + "\n");
+        if len(r.sorted_fields()):
+            fd_c.write(r.c_field_table(c_bit) + "\n");
+
+    fd_c.write("static unsigned int resolve_bit(riscv_debug_reg_bit_t bit, riscv_debug_reg_ctx_t context)\n" +
+               "{\n\t" +
+               add_indent("switch (bit.symbol) {\n" +
+                          "case RISCV_DEBUG_REG_SYMBOL_NONE:\n" +
+                          "\treturn bit.constant;\n" +
+                          "".join(f"case {c_symbol_name(s)}:\n" +
+                                  f"\tassert(context.{s}.is_set);\n" +
+                                  f"\treturn context.{s}.value + bit.constant;\n"
+                                  for s in symbols) +
+                          "}\n" +
+                          "assert(0);\n" +
+                          "return 0;") +
+               "\n}\n\n")
+
+    resolve_func = ("riscv_debug_reg_field_info_t riscv_debug_reg_resolve_field(" +
+                    "riscv_debug_reg_field_desc_t desc, riscv_debug_reg_ctx_t context)")
+    fd_h.write(resolve_func + ";\n")
+    fd_c.write(resolve_func + "\n" +
+               "{\n\t" +
+               add_indent("riscv_debug_reg_field_info_t result = {\n" +
+                          "\t.name = desc.name,\n" +
+                          "\t.lsb = resolve_bit(desc.lsb, context),\n" +
+                          "\t.msb = resolve_bit(desc.msb, context),\n" +
+                          "\t.values = desc.values,\n" +
+                          "\t.value_names = desc.value_names,\n" +
+                          "\t.value_name_count = desc.value_name_count,\n" +
+                          "\t.upper_lsb = resolve_bit(desc.upper_lsb, context),\n" +
+                          "\t.upper_bits = desc.upper_bits\n" +
+                          "};\n" +
+                          "return result;") +
+               "\n}\n\n")
+
+    get_info_func = "riscv_debug_reg_info_t get_riscv_debug_reg_info(enum riscv_debug_reg_ordinal reg_ordinal)"
+    fd_h.write(get_info_func + ";\n")
+    fd_c.write(get_info_func + "\n" +
+               "{\n\t" +
+               add_indent("static const riscv_debug_reg_info_t debug_reg_info[] = {\n\t" +
+                          add_indent("\n".join(f"[{r.ordinal_name()}] = {{\n\t{add_indent(r.c_table_info())}\n}},"
+                                               for r in all_regs)) +
+                          "\n};\n" +
+                          "return debug_reg_info[reg_ordinal];") +
+               "\n}\n")
+
 def write_chisel( fd, registers ):
     fd.write("package freechips.rocketchip.devices.debug\n\n")
     fd.write("import chisel3._\n\n")
@@ -655,6 +1974,159 @@ def write_chisel( fd, registers ):
 
             fd.write("}\n\n")
 
+def python_expression( expression ):
+    """Return Python source for expression."""
+    expression = BitExpression.coerce( expression )
+    if expression.nonlinear is not None:
+        return sympy.pycode( expression.nonlinear )
+    return str( expression )
+
+def python_mask( length ):
+    """Return Python source for a mask of length bits."""
+    length = BitExpression.coerce( length )
+    if length.is_constant():
+        return format_c_number( 2 ** int( length ) - 1, unsigned=False )
+    return "((1 << (%s)) - 1)" % python_expression( length )
+
+def python_field_value( f ):
+    """Return Python source that extracts field f from value."""
+    if f.lsb.is_constant() and int( f.lsb ) == 0:
+        value = "value"
+    elif f.lsb.is_constant():
+        value = "(value >> %d)" % int( f.lsb )
+    else:
+        value = "(value >> (%s))" % python_expression( f.lsb )
+    return "%s & %s" % ( value, python_mask( f.length() ) )
+
+def python_constant( name, expression ):
+    """Return a constant, or a function of the symbols it depends on, like
+    the Macro of the same name in C."""
+    expression = BitExpression.coerce( expression )
+    if expression.is_constant():
+        return "%s = %s\n" % ( name, format_c_number( int( expression ),
+            unsigned=False ) )
+    return "def %s(%s):\n    return %s\n" % ( name,
+            ", ".join( sorted( expression.symbols() ) ),
+            python_expression( expression ) )
+
+def write_python( fd, registers ):
+    """Write a Python module with the same constants as write_cheader(), the
+    names of field values, and a function decoding the value of each
+    register. The module doesn't import anything, so it is much faster to
+    load than this script and the XML."""
+    definitions = []
+    decoders = []
+    for r in registers.registers:
+        address = address_value( r.address )
+        if r.to_c_filter() and isinstance( address, int ):
+            definitions.append(( r.address_define_name(), address ))
+        fields = [ f for f in r.fields if f.to_c_filter() ]
+        for f in fields:
+            definitions.append(( f.offset_define_name(), f.lsb ))
+            definitions.append(( "%s_LENGTH" % f.mask_define_name(), f.length() ))
+            definitions.append(( f.mask_define_name(), f.mask() ))
+            for v in f.values:
+                definitions += [ d for d in v.to_c_definitions( f.mask_define_name() )
+                        if d[0] != "comment" ]
+            named_values = f.c_named_values()
+            if named_values:
+                definitions.append(( "%s_VALUES" % f.mask_define_name(),
+                    named_values ))
+        if r.define and fields:
+            decoders.append(( r, fields ))
+
+    counted = collections.Counter( r.label for r, fields in decoders )
+    decoders = [ ( r, fields, sorted( r.symbols() &
+        set().union( *( f.symbols() for f in fields ) ) ) )
+        for r, fields in decoders if counted[r.label] == 1 ]
+    decoded = set( r.label for r, fields, symbols in decoders )
+    needed = sorted( set().union( *( symbols for r, fields, symbols in decoders ) ) )
+    variants = []
+    for d in AddressIndex( [ registers ] ).dispatches():
+        names = [ ( value, r.label ) for value, r in d.variants if r.label in decoded ]
+        if d.register.label in decoded and names:
+            variants.append(( d.register.label, d.field.name, names ))
+
+    fd.write( '"""Constants and decoders for the %s.\n\n' % registers.name )
+    fd.write( "decode(name, value, **symbols) returns a dict of the fields of a "
+            "register value.\n" )
+    if needed:
+        fd.write( "The symbols a register's fields depend on (%s in this "
+                "module) are\nrequired keyword arguments when decoding it. "
+                "DECODERS lists the symbols\neach register needs.\n" %
+                ", ".join( needed ) )
+    fd.write( "The <field>_VALUES dicts map field values to their names.\n" )
+    if variants:
+        fd.write( "decode_variant() first picks which of the registers sharing "
+                "an address (like\n%s and %s) describes the value.\n" % (
+                    variants[0][0], variants[0][2][0][1] ) )
+    fd.write( "\nGenerated by registers.py from the riscv-debug-spec XML. Do not "
+            "edit.\n\"\"\"\n\n" )
+
+    counted = collections.Counter( name for name, value in definitions )
+    for name, value in definitions:
+        if counted[name] != 1:
+            continue
+        if isinstance( value, list ):
+            fd.write( "%s = {\n" % name )
+            for v, text in value:
+                fd.write( "    %d: %r,\n" % ( v, text ) )
+            fd.write( "}\n" )
+        else:
+            fd.write( python_constant( name, value ) )
+
+    table = []
+    for r, fields, symbols in decoders:
+        function = "decode_%s" % r.address_define_name().lower()
+        fd.write( "\ndef %s(%s):\n" % ( function, ", ".join( [ "value" ] + symbols ) ) )
+        fd.write( '    """Return the fields of a %s value."""\n' % r.name )
+        fd.write( "    return {\n" )
+        for f in fields:
+            fd.write( "        %r: %s,\n" % ( f.name, python_field_value( f ) ) )
+        fd.write( "    }\n" )
+        table.append(( r.label, function, symbols ))
+
+    fd.write( "\n# Register name -> (decode function, symbols it needs)\n" )
+    fd.write( "DECODERS = {\n" )
+    for label, function, symbols in table:
+        fd.write( "    %r: (%s, %r),\n" % ( label, function, tuple( symbols ) ) )
+    fd.write( "}\n" )
+    fd.write( "\n# Register name -> (field, field value -> name of the register that\n"
+            "# describes values with that field value)\n" )
+    fd.write( "VARIANTS = {\n" )
+    for label, field, names in variants:
+        fd.write( "    %r: (%r, {%s}),\n" % ( label, field,
+            ", ".join( "%d: %r" % v for v in names ) ) )
+    fd.write( "}\n" )
+    fd.write( """
+def decode(name, value, **symbols):
+    \"\"\"Return the fields of value, which belongs to the register called
+    name, as a dict. Every symbol the register depends on must be given.
+    Others are ignored.\"\"\"
+    function, needed = DECODERS[name.lower()]
+    missing = [s for s in needed if s not in symbols]
+    if missing:
+        raise ValueError("%s depends on %s." % (name, ", ".join(missing)))
+    return function(value, *(symbols[s] for s in needed))
+
+def variant(name, value, **symbols):
+    \"\"\"Return the name of the register that describes value, which was read
+    from the register called name. That is name, unless a field of the value
+    tells which of the registers at the same address applies, like
+    tdata1.type does for mcontrol, icount, etc.\"\"\"
+    name = name.lower()
+    if name not in VARIANTS:
+        return name
+    field, names = VARIANTS[name]
+    return names.get(decode(name, value, **symbols)[field], name)
+
+def decode_variant(name, value, **symbols):
+    \"\"\"Return the name of the register that describes value (see variant()),
+    and the fields of value in that register.\"\"\"
+    name = variant(name, value, **symbols)
+    return name, decode(name, value, **symbols)
+""" )
+
 def address_value( address ):
     if type( address ) == str:
         try:
@@ -663,11 +2135,93 @@ def address_value( address ):
             return address
     return address
 
-def compare_address(a, b):
+def address_key( address ):
+    """Return a key that sorts addresses in numeric order. Constant addresses
+    come first, then symbolic ones, and then registers without an
+    address."""
+    if address is None:
+        return ( 3, 0, "" )
+    if isinstance( address, int ):
+        return ( 0, address, "" )
     try:
-        return int(sympy.simplify("%s-(%s)" % (a, b)))
-    except TypeError:
-        return cmp(a, b)
+        expression = BitExpression.parse_affine( address )
+    except ValueError:
+        return ( 2, 0, address )
+    if expression.is_constant():
+        return ( 0, expression.constant, "" )
+    return ( 1, expression.constant, str( expression ) )
+
+class AddressIndex( object ):
+    """Registers by address, across any number of Registers. Registers with
+    the same prefix (e.g. CSR_) share an address space. Addresses may be
+    given as ints or as the strings used in the XML."""
+    def __init__( self, registers_list=() ):
+        # space -> address_key() -> [Register]
+        self.spaces = {}
+        self._dispatches = None
+        for registers in registers_list:
+            self.add( registers )
+
+    @staticmethod
+    def space( registers ):
+        return registers.prefix or registers.name
+
+    def add( self, registers ):
+        addresses = self.spaces.setdefault( self.space( registers ), {} )
+        self._dispatches = None
+        for r in registers.registers:
+            addresses.setdefault( address_key( r.address ), [] ).append( r )
+
+    def at( self, address, space=None ):
+        """Return every register at address, in the order they were added. If
+        space isn't given, look in every address space."""
+        key = address_key( address )
+        if space is not None:
+            return list( self.spaces.get( space, {} ).get( key, () ) )
+        return [ r for addresses in self.spaces.values()
+                for r in addresses.get( key, () ) ]
+
+    def find( self, address, space=None ):
+        """Return the first register at address. Raise KeyError if there is
+        none."""
+        found = self.at( address, space )
+        if not found:
+            raise KeyError( address )
+        return found[0]
+
+    def sorted( self ):
+        """Return all the registers in address order. Registers at the same
+        address stay in the order they were added."""
+        return [ r for addresses in self.spaces.values()
+                for key in sorted( addresses ) for r in addresses[key] ]
+
+    def duplicates( self ):
+        """Return ( space, address, registers ) for every address that is used
+        by more than one register, such as the trigger registers that all
+        alias tdata1."""
+        return [ ( space, addresses[key][0].address, addresses[key] )
+                for space, addresses in self.spaces.items()
+                for key in sorted( addresses )
+                if len( addresses[key] ) > 1 and key[0] != 3 ]
+
+    def dispatches( self ):
+        """Return a Dispatch for every field whose value names are the names
+        of other registers at the same address, like tdata1.type. Only fields
+        whose values fit in a small table qualify."""
+        if self._dispatches is None:
+            self._dispatches = []
+            for space, address, registers in self.duplicates():
+                for r in registers:
+                    labels = { o.label: o for o in registers if o is not r }
+                    for f in r.fields:
+                        if not f.to_c_filter() or not f.c_values_dense():
+                            continue
+                        variants = [ ( value, labels[name.lower()] )
+                                for value, name in f.c_named_values()
+                                if name.lower() in labels ]
+                        if variants:
+                            self._dispatches.append( Dispatch( r, f, variants ) )
+        return self._dispatches
 
 def print_latex_index( registers ):
     print(registers.description)
@@ -693,8 +2247,7 @@ def print_latex_index( registers ):
             len(columns))
     print("      \\endfoot")
     print("      \\endlastfoot")
-    for r in sorted( registers.registers,
-            key=cmp_to_key(lambda a, b: compare_address(a.address, b.address))):
+    for r in registers.address_index().sorted():
         if r.short and (r.fields or r.description):
             page = "\\pageref{%s}" % toLatexIdentifier(registers.prefix, r.short)
         else:
@@ -747,21 +2300,23 @@ def print_latex_custom( registers ):
 
             print("\\begin{center}")
 
-            totalWidth = sum( ( 3 + f.columnWidth() ) for f in r.fields )
+            layout = r.layout()
+            columns = list( zip( r.fields, layout.widths, layout.lengths ) )
+            totalWidth = sum( ( 3 + width ) for width in layout.widths )
             split = int( math.ceil( totalWidth / 80. ) )
             fieldsPerSplit = int( math.ceil( float( len( r.fields ) ) / split ) )
-            subRegisterFields = []
+            subRegisterColumns = []
             for s in range( split ):
-                subRegisterFields.append( r.fields[ s*fieldsPerSplit : (s+1)*fieldsPerSplit ] )
+                subRegisterColumns.append( columns[ s*fieldsPerSplit : (s+1)*fieldsPerSplit ] )
 
-            for registerFields in subRegisterFields:
+            for registerColumns in subRegisterColumns:
+                registerFields = [ f for f, width, length in registerColumns ]
                 tabularCols = ""
-                for f in registerFields:
-                    fieldLength = str( f.length() )
+                for f, width, length in registerColumns:
                     lowLen = float( len( f.lowBit ) )
                     highLen = float( len( f.highBit ) )
-                    tabularCols += "p{%.1f ex}" % ( f.columnWidth() * highLen / ( lowLen + highLen ) )
-                    tabularCols += "p{%.1f ex}" % ( f.columnWidth() * lowLen / ( lowLen + highLen ) )
+                    tabularCols += "p{%.1f ex}" % ( width * highLen / ( lowLen + highLen ) )
+                    tabularCols += "p{%.1f ex}" % ( width * lowLen / ( lowLen + highLen ) )
                 print("\\begin{tabular}{%s}" % tabularCols)
 
                 first = True
@@ -791,7 +2346,8 @@ def print_latex_custom( registers ):
                 print("         \hline")
 
                 # Size of each field in bits
-                print(" & ".join( "\\multicolumn{2}{c}{\\scriptsize %s}" % f.length() for f in registerFields ))
+                print(" & ".join( "\\multicolumn{2}{c}{\\scriptsize %s}" % length
+                    for f, width, length in registerColumns ))
                 print("\\\\")
 
                 print("   \\end{tabular}")
@@ -882,154 +2438,283 @@ def add_continuations(text):
         result.append(current_line)
     return "\n".join(result)
 
-def write_bytefield_row( fd, fields ):
-    # Have a minimum width, otherwise small registers look huge.
-    totalWidth = sum( f.columnWidth() for f in fields )
-    padding = max(0, 24 - totalWidth)
-    fd.write("[bytefield]\n")
-    fd.write("----\n")
-    fd.write("(def row-height 45)\n")
-    fd.write("(def row-header-fn nil)\n")
-    fd.write(f"(def boxes-per-row {totalWidth + padding})\n")
-    # TODO: column headers
-
-    headers = [""] * padding
-    columnOffset = 0
-    for f in reversed(fields):
-        columnWidth = f.columnWidth()
-        if f.length() == 1:
-            if columnWidth > 1:
-                before = columnWidth // 2
-                after = columnWidth - before - 1
-                headers += [""] * before
-                headers.append(f.lowBit)
-                headers += [""] * after
+class BytefieldRow( object ):
+    """One row of a bytefield diagram: its fields, the width of each field's
+    column in boxes, and the label over each box."""
+    def __init__( self, fields, widths, lengths ):
+        self.fields = fields
+        self.widths = widths
+        self.lengths = lengths
+        width = sum( widths )
+        # Have a minimum width, otherwise small registers look huge.
+        self.padding = max(0, 24 - width)
+        self.boxes = width + self.padding
+        self.headers = self.column_headers()
+
+    def column_headers( self ):
+        """Return the label over each box, from left to right."""
+        headers = [""] * self.padding
+        for f, columnWidth, length in zip( reversed( self.fields ),
+                reversed( self.widths ), reversed( self.lengths ) ):
+            if length == 1:
+                if columnWidth > 1:
+                    before = columnWidth // 2
+                    after = columnWidth - before - 1
+                    headers += [""] * before
+                    headers.append(f.lowBit)
+                    headers += [""] * after
+                else:
+                    headers.append(f.lowBit)
             else:
-                headers.append(f.lowBit)
+                # If low/high bit need more than 2 characters, place them one in
+                # from the end so they don't overflow into the neighboring field.
+                # Really this should be done with right/left alignment, but
+                # bytefield doesn't seem to support that.
+                if len(f.lowBit) > 2:
+                    start = ["", f.lowBit]
+                else:
+                    start = [f.lowBit]
+                if len(f.highBit) > 2:
+                    end = [f.highBit, ""]
+                else:
+                    end = [f.highBit]
+                assert columnWidth >= len(start) + len(end)
+                headers += start
+                headers += [""] * (columnWidth - len(start) - len(end))
+                headers += end
+        # remove whitespace to save space
+        return [h.replace(" ", "") for h in reversed(headers)]
+
+class BytefieldLayout( object ):
+    """The layout of a register diagram, computed once per register (see
+    Register.layout()) and shared by everything that draws it: the width of
+    each field's column, the length of each field, and the rows the fields
+    are split into."""
+    maxWidth = 40
+
+    def __init__( self, fields ):
+        stats.count( "bytefield_layouts" )
+        self.fields = fields
+        self.widths = [ f.columnWidth() for f in fields ]
+        self.lengths = [ f.length() for f in fields ]
+        self.totalWidth = sum( self.widths )
+        self.rows = [ BytefieldRow( [ fields[i] for i in row ],
+            [ self.widths[i] for i in row ], [ self.lengths[i] for i in row ] )
+            for row in self.split_rows() ]
+
+    def split_rows( self ):
+        """Return the indices of the fields in each row."""
+        if self.totalWidth > self.maxWidth:
+            rowCount = math.ceil(self.totalWidth / self.maxWidth)
         else:
-            # If low/high bit need more than 2 characters, place them one in
-            # from the end so they don't overflow into the neighboring field.
-            # Really this should be done with right/left alignment, but
-            # bytefield doesn't seem to support that.
-            if len(f.lowBit) > 2:
-                start = ["", f.lowBit]
-            else:
-                start = [f.lowBit]
-            if len(f.highBit) > 2:
-                end = [f.highBit, ""]
+            rowCount = 1
+
+        rowWidth = self.totalWidth / rowCount
+        rows = [[]]
+        offset = 0
+        for i, width in enumerate( self.widths ):
+            if rowWidth - offset > width / 2 or len(rows) >= rowCount:
+                rows[-1].append(i)
+                offset += width
             else:
-                end = [f.highBit]
-            assert columnWidth >= len(start) + len(end)
-            headers += start
-            headers += [""] * (columnWidth - len(start) - len(end))
-            headers += end
-        columnOffset += columnWidth
-    # remove whitespace to save space
-    headers = [h.replace(" ", "") for h in headers]
-    fd.write('(draw-column-headers {:font-size 15 :height 17 :labels [%s]})\n' % " ".join(f'"{h}"' for h in reversed(headers)))
-
-    for f in fields:
-        fd.write('(draw-box (text "%s" {:font-size 20}) {:span %s})\n' % ( f.name, f.columnWidth() ))
-    if padding:
-        fd.write('(draw-box "" {:span %s :borders {}})\n' % ( padding ))
-
-    for f in fields:
-        fd.write('(draw-box "%s" {:span %s :borders {}})\n' % ( f.length(), f.columnWidth() ))
-    if padding:
-        fd.write('(draw-box "" {:span %s :borders {}})\n' % ( padding ))
+                rows.append([i])
+                offset = width
+        return rows
 
+def write_bytefield_row( fd, row ):
+    fd.write("[bytefield]\n")
     fd.write("----\n")
+    fd.write("(def row-height 45)\n")
+    fd.write("(def row-header-fn nil)\n")
+    fd.write(f"(def boxes-per-row {row.boxes})\n")
+    fd.write('(draw-column-headers {:font-size 15 :height 17 :labels [%s]})\n' % " ".join(f'"{h}"' for h in row.headers))
 
-def write_bytefield( fd, register ):
-    """Return a bytefield representation of the register."""
-    totalWidth = sum( f.columnWidth() for f in register.fields )
+    for f, width in zip( row.fields, row.widths ):
+        fd.write('(draw-box (text "%s" {:font-size 20}) {:span %s})\n' % ( f.name, width ))
+    if row.padding:
+        fd.write('(draw-box "" {:span %s :borders {}})\n' % ( row.padding ))
 
-    maxWidth = 40
-    if totalWidth > maxWidth:
-        rowCount = math.ceil(totalWidth / maxWidth)
-    else:
-        rowCount = 1
+    for length, width in zip( row.lengths, row.widths ):
+        fd.write('(draw-box "%s" {:span %s :borders {}})\n' % ( length, width ))
+    if row.padding:
+        fd.write('(draw-box "" {:span %s :borders {}})\n' % ( row.padding ))
 
-    rowWidth = totalWidth / rowCount
-    rows = [[]]
-    offset = 0
-    for f in register.fields:
-        if rowWidth - offset > f.columnWidth() / 2 or len(rows) >= rowCount:
-            rows[-1].append(f)
-            offset += f.columnWidth()
-        else:
-            rows.append([])
-            rows[-1].append(f)
-            offset = f.columnWidth()
+    fd.write("----\n")
 
+@timed( "bytefield" )
+def write_bytefield( fd, register ):
+    """Return a bytefield representation of the register."""
     # Provide separation from a previous ordered list.
     fd.write("\n")
-    for row in rows:
+    for row in register.layout().rows:
         write_bytefield_row(fd, row)
 
-def write_adoc( fd, registers ):
+def write_adoc_register( fd, registers, r ):
     sub = "=" * registers.depth
-    for r in registers.registers:
-        if not r.fields and not r.description:
-            continue
+    if r.label and r.define:
+        fd.write("[[%s]]\n" % toAdocIdentifier(registers.prefix, r.label))
+    if r.short:
+        # TODO: Check that (((foo))) renders as ((foo)) inside parens
+        if r.address:
+            fd.write(f"==={sub} {r.name} ((({r.short})), at {r.address})\n")
+        else:
+            fd.write(f"==={sub} {r.name} ((({r.short})))\n")
+        # TODO: confirm that index works
+    else:
+        if r.address:
+            fd.write(f"==={sub} ((`{r.name}`)) (at {r.address})\n")
+        else:
+            fd.write(f"==={sub} ((`{r.name}`))\n")
+    fd.write("\n")
+    fd.write(remove_indent(r.description))
+    fd.write("\n\n")
 
-        if r.label and r.define:
-            fd.write("[[%s]]\n" % toAdocIdentifier(registers.prefix, r.label))
-        if r.short:
-            # TODO: Check that (((foo))) renders as ((foo)) inside parens
-            if r.address:
-                fd.write(f"==={sub} {r.name} ((({r.short})), at {r.address})\n")
+    if r.fields or r.diagram:
+        if registers.prefix == "CSR_":
+            if int(r.address, 0) >= 0xc00:
+                fd.write("This CSR is read-only.\n")
+            elif all(f.access in ('R', '0') for f in r.fields):
+                fd.write("Writing this read/write CSR has no effect.\n")
             else:
-                fd.write(f"==={sub} {r.name} ((({r.short})))\n")
-            # TODO: confirm that index works
+                fd.write("This CSR is read/write.\n")
+        elif all(f.access in ('R', '0') for f in r.fields):
+            fd.write("This entire register is read-only.\n")
+
+        if r.diagram:
+            fd.write(f"{remove_indent(r.diagram)}\n")
         else:
-            if r.address:
-                fd.write(f"==={sub} ((`{r.name}`)) (at {r.address})\n")
-            else:
-                fd.write(f"==={sub} ((`{r.name}`))\n")
-        fd.write("\n")
-        fd.write(remove_indent(r.description))
-        fd.write("\n\n")
+            write_bytefield( fd, r )
 
-        if r.fields or r.diagram:
-            if registers.prefix == "CSR_":
-                if int(r.address, 0) >= 0xc00:
-                    fd.write("This CSR is read-only.\n")
-                elif all(f.access in ('R', '0') for f in r.fields):
-                    fd.write("Writing this read/write CSR has no effect.\n")
-                else:
-                    fd.write("This CSR is read/write.\n")
-            elif all(f.access in ('R', '0') for f in r.fields):
-                fd.write("This entire register is read-only.\n")
+    columns = [("<23", "Field", lambda f: f"(({f.name}))")]
+    columns += [("<61", "Description", lambda f: f.latex_description())]
+    if not registers.skip_access:
+        columns += [("^10", "Access", lambda f: f"*{f.access}*")]
+    if not registers.skip_reset:
+        columns += [("^10", "Reset", lambda f: f.reset)]
 
-            if r.diagram:
-                fd.write(f"{remove_indent(r.diagram)}\n")
-            else:
-                write_bytefield( fd, r )
+    if any( f.description for f in r.fields ):
+        cols = ",".join(c[0] for c in columns)
+        fd.write(f'[float="center",align="center",cols="{cols}",options="header"]\n')
+        fd.write("|===\n")
 
-        columns = [("<23", "Field", lambda f: f"(({f.name}))")]
-        columns += [("<61", "Description", lambda f: f.latex_description())]
-        if not registers.skip_access:
-            columns += [("^10", "Access", lambda f: f"*{f.access}*")]
-        if not registers.skip_reset:
-            columns += [("^10", "Reset", lambda f: f.reset)]
+        fd.write("|" + " |".join(c[1] for c in columns) + "\n")
 
-        if any( f.description for f in r.fields ):
-            cols = ",".join(c[0] for c in columns)
-            fd.write(f'[float="center",align="center",cols="{cols}",options="header"]\n')
-            fd.write("|===\n")
+        for f in r.fields:
+            if f.description or f.values:
+                identifier = toAdocIdentifier(r.short or r.label, f.name)
+                fd.write(f"|[[{identifier}]] `{columns[0][2](f)}`\n")
+                for c in columns[1:]:
+                    fd.write("a|" + remove_indent( c[2](f) ) + "\n")
 
-            fd.write("|" + " |".join(c[1] for c in columns) + "\n")
+        fd.write("|===\n")
+    fd.write("\n")
 
-            for f in r.fields:
-                if f.description or f.values:
-                    identifier = toAdocIdentifier(r.short or r.label, f.name)
-                    fd.write(f"|[[{identifier}]] `{columns[0][2](f)}`\n")
-                    for c in columns[1:]:
-                        fd.write("a|" + remove_indent( c[2](f) ) + "\n")
+# How many rendered fragments a FragmentCache keeps in memory. That's more
+# than all the registers of every XML file, so only fragments of registers
+# that have since been edited (e.g. in --watch) are dropped.
+FRAGMENT_CACHE_SIZE = 4096
+# How long a fragment in --cache-dir is kept without being used.
+FRAGMENT_MAX_AGE = 30 * 24 * 60 * 60
+
+class FragmentCache( object ):
+    """Rendered output for single registers, keyed by a digest of everything
+    the rendering depends on. The most recently used fragments are kept in
+    memory, and all of them in cache_dir if that is set. Fragments in
+    cache_dir that haven't been used for max_age seconds are deleted when
+    the cache is made."""
+    def __init__( self, cache_dir=None, size=FRAGMENT_CACHE_SIZE,
+            max_age=FRAGMENT_MAX_AGE ):
+        self.cache_dir = cache_dir
+        self.size = size
+        self.fragments = collections.OrderedDict()
+        if cache_dir:
+            self.prune( max_age )
+
+    def prune( self, max_age ):
+        """Delete the fragments in cache_dir that were last used more than
+        max_age seconds ago."""
+        directory = os.path.join( self.cache_dir, "fragments" )
+        try:
+            names = os.listdir( directory )
+        except FileNotFoundError:
+            return
+        oldest = time.time() - max_age
+        for name in names:
+            path = os.path.join( directory, name )
+            try:
+                if os.stat( path ).st_mtime < oldest:
+                    os.unlink( path )
+                    stats.count( "fragments_pruned" )
+            except FileNotFoundError:
+                pass
+
+    def remember( self, key, text ):
+        self.fragments[key] = text
+        self.fragments.move_to_end( key )
+        while len( self.fragments ) > self.size:
+            self.fragments.popitem( last=False )
+
+    def key( self, kind, registers, register ):
+        if register.digest is None:
+            return None
+        h = hashlib.sha256( generator_digest() )
+        h.update( repr(( kind, registers.prefix, registers.depth,
+            registers.skip_access, registers.skip_reset )).encode() )
+        h.update( register.digest.encode() )
+        return h.hexdigest()
+
+    def get( self, kind, registers, register, render ):
+        """Return the fragment of the given kind for register, calling
+        render() to create it if it's not in the cache."""
+        key = self.key( kind, registers, register )
+        if key is None:
+            return render()
+        if key in self.fragments:
+            stats.count( "fragment_cache_hits" )
+            self.fragments.move_to_end( key )
+            return self.fragments[key]
+        path = None
+        if self.cache_dir:
+            path = os.path.join( self.cache_dir, "fragments", key )
+            try:
+                with open( path, encoding="utf-8" ) as f:
+                    text = f.read()
+                # Mark the fragment as used, so prune() keeps it.
+                os.utime( path )
+                stats.count( "fragment_cache_hits" )
+                self.remember( key, text )
+                return text
+            except FileNotFoundError:
+                pass
+        stats.count( "fragment_cache_misses" )
+        text = render()
+        self.remember( key, text )
+        if path:
+            os.makedirs( os.path.dirname( path ), exist_ok=True )
+            write_if_changed( path, text )
+        return text
+
+_fragment_caches = {}
+def fragment_cache( cache_dir=None ):
+    """Return the FragmentCache for cache_dir, shared by everything in this
+    process."""
+    if cache_dir not in _fragment_caches:
+        _fragment_caches[cache_dir] = FragmentCache( cache_dir )
+    return _fragment_caches[cache_dir]
+
+def write_adoc( fd, registers, fragments=None ):
+    """Write asciidoc for every register. If fragments is given, registers
+    that haven't changed are copied from that FragmentCache instead of being
+    rendered again."""
+    for r in registers.registers:
+        if not r.fields and not r.description:
+            continue
 
-            fd.write("|===\n")
-        fd.write("\n")
+        if fragments is None:
+            write_adoc_register( fd, registers, r )
+        else:
+            fd.write( fragments.get( "adoc", registers, r,
+                lambda: capture_write( write_adoc_register, registers, r ) ) )
 
 def write_adoc_index( fd, registers ):
     fd.write(remove_indent(registers.description) + "\n")
@@ -1047,8 +2732,7 @@ def write_adoc_index( fd, registers ):
     fd.write("|===\n")
     fd.write("|" + " |".join(c[0] for c in columns) + "\n")
 
-    for r in sorted( registers.registers,
-            key=cmp_to_key(lambda a, b: compare_address(a.address, b.address))):
+    for r in registers.address_index().sorted():
         identifier = toAdocIdentifier(registers.prefix, r.short or r.name)
         if r.short:
             name = "%s ({%s})" % (r.name, identifier)
@@ -1064,9 +2748,18 @@ def write_adoc_index( fd, registers ):
             fd.write("|%s |%s| %s\n" % ( r.address, name, link ))
     fd.write("|===\n")
 
-def main():
+def parse_define( text ):
+    """Parse a --define argument into a ( symbol, value ) tuple."""
+    symbol, equals, value = text.partition( "=" )
+    try:
+        return symbol.strip(), int( value, 0 )
+    except ValueError:
+        raise argparse.ArgumentTypeError(
+                "expected SYMBOL=VALUE with an integer value, not %r" % text )
+
+def argument_parser():
     parser = argparse.ArgumentParser()
-    parser.add_argument( 'path' )
+    parser.add_argument( 'path', nargs='?' )
     parser.add_argument( '--register', action='store_true',
             help='Use the LaTeX register module. No support for symbolic bit '
             'start/end positions.' )
@@ -1082,42 +2775,183 @@ def main():
             help='Write C #defines to the named file.' )
     parser.add_argument( '--chisel',
             help='Write Scala Classes to the named file.' )
+    parser.add_argument( '--python',
+            help='Write a standalone Python module with constants and decoders '
+            'to the named file.' )
     parser.add_argument( '--cgetters', dest='xml_paths', nargs='+')
+    parser.add_argument( '--check-addresses', action='store_true',
+            help='Report registers that share an address with another '
+            'register in the same address space.' )
+    parser.add_argument( '--define', metavar='SYMBOL=VALUE', type=parse_define,
+            action='append',
+            help='Generate output for this value of a symbol such as XLEN, so '
+            'that C macros, offsets and masks that depend on it become '
+            'constants. May be given more than once.' )
+    parser.add_argument( '--cfield-tables', action='store_true',
+            help='With --cgetters, describe the fields of each register with a '
+            'static const array, instead of a chain of getter functions. '
+            'debug_reg_printer.c supports both.' )
     parser.add_argument( '--create',
             help='Line included in the output described how the file was created.' )
-    parsed = parser.parse_args()
-
-    if (parsed.xml_paths):
-        registers_list = [parse_xml( xml_path ) for xml_path in parsed.xml_paths]
-        license_lists = [registers.licenses for registers in registers_list]
-        # Assert every license list is the same
-        assert all(license_lists[0] == license_list for license_list in license_lists), \
-                "All XML files must have the same SPDX-License-Identifier"
-        fd_h = open( parsed.path + ".h", "w" )
+    parser.add_argument( '--batch', metavar='MANIFEST', nargs='+',
+            help='Run every command line listed in the named manifest files '
+            '("-" for stdin) in this one process, parsing each XML file only '
+            'once. Each line of a manifest holds the arguments for one '
+            'invocation of this script; blank lines and lines starting with # '
+            'are ignored.' )
+    parser.add_argument( '-j', '--jobs', type=int, default=1,
+            help='Parse XML files and write outputs using this many processes. '
+            '0 means one per CPU. Every output must be written to a different '
+            'file.' )
+    parser.add_argument( '--cache-dir',
+            default=os.environ.get( 'REGISTERS_CACHE_DIR' ),
+            help='Cache parsed and checked XML files in this directory, so '
+            'unchanged files are not parsed again. Rendered asciidoc of each '
+            'register is cached there too; fragments that have not been used '
+            'for 30 days are deleted. Defaults to $REGISTERS_CACHE_DIR.' )
+    parser.add_argument( '--watch', action='store_true',
+            help='After generating the outputs, keep running and regenerate '
+            'the outputs of any XML file that changes. Everything runs in '
+            'this process; --jobs is ignored.' )
+    parser.add_argument( '--watch-interval', type=float, default=0.1,
+            metavar='SECONDS',
+            help='How long to wait for a changed file to settle, or how '
+            'often to poll if inotify is not available.' )
+    parser.add_argument( '--stream', action='store_true',
+            help='Parse the XML file a register at a time while writing each '
+            'output, instead of loading it all first. This keeps memory use '
+            'down for very large files, but only works for outputs that need '
+            'one register at a time (--adoc of files with skip_index set, '
+            '--adoc-definitions, --definitions and --cheader), and asking '
+            'for any other output is an error. The LaTeX index is not '
+            'printed. Ignored with --jobs.' )
+    parser.add_argument( '--decode-log', metavar='LOG',
+            help='Decode the DMI reads and writes in an OpenOCD debug log '
+            '("-" for stdin), using the registers in path (e.g. '
+            'xml/dm_registers.xml). The log is decoded in chunks on --jobs '
+            'processes, and the output is in the same order as the log.' )
+    parser.add_argument( '--log-format', choices=( 'jsonl', 'csv' ),
+            default='jsonl',
+            help='With --decode-log, write a JSON object or a CSV row per '
+            'transaction.' )
+    parser.add_argument( '--log-output', metavar='FILE',
+            help='With --decode-log, write to the named file instead of '
+            'stdout.' )
+    parser.add_argument( '--stats-json', metavar='FILE',
+            help='Write wall clock times for each phase and backend, and '
+            'counters such as cache hits and bytes written, to the named JSON '
+            'file.' )
+    parser.add_argument( '--profile', metavar='FILE',
+            help='Profile the run with cProfile, and write the result to the '
+            'named file (for use with pstats). Work done in -j worker '
+            'processes is not included.' )
+    return parser
+
+@timed( "write" )
+def write_if_changed( path, text ):
+    """Write text to path, unless path already contains exactly that. The
+    file is replaced atomically, so readers never see a partial file. Return
+    True if the file was written."""
+    data = text.encode()
+    try:
+        with open( path, "rb" ) as f:
+            if f.read() == data:
+                stats.count( "files_unchanged" )
+                return False
+        mode = os.stat( path ).st_mode & 0o7777
+    except FileNotFoundError:
+        umask = os.umask( 0 )
+        os.umask( umask )
+        mode = 0o666 & ~umask
+
+    fd, tmp_path = tempfile.mkstemp( dir=os.path.dirname( path ) or ".",
+            prefix=os.path.basename( path ) + ".", suffix=".tmp" )
+    try:
+        with os.fdopen( fd, "wb" ) as f:
+            f.write( data )
+        os.chmod( tmp_path, mode )
+        os.replace( tmp_path, path )
+    except BaseException:
+        os.unlink( tmp_path )
+        raise
+    stats.count( "files_written" )
+    stats.count( "bytes_written", len( data ) )
+    return True
+
+@contextlib.contextmanager
+def output_file( path ):
+    """Like open( path, "w" ), but the output is collected in memory and
+    written with write_if_changed() when the block completes."""
+    fd = io.StringIO()
+    yield fd
+    write_if_changed( path, fd.getvalue() )
+
+def generated_comment( parsed, registers ):
+    """Return the comment placed at the top of generated asciidoc. It only
+    changes when the input does, so that rebuilding unchanged files doesn't
+    produce different output."""
+    epoch = os.environ.get( "SOURCE_DATE_EPOCH" )
+    if epoch:
+        date = datetime.fromtimestamp( int( epoch ), timezone.utc )
+        return f"// Auto-generated on {date} from {parsed.path}\n"
+    return f"// Auto-generated from {parsed.path} (sha256 {registers.digest})\n"
+
+def specialized( parsed, registers ):
+    """Apply the --define options in parsed to registers."""
+    if not parsed.define:
+        return registers
+    return specialize( registers, dict( parsed.define ) )
+
+def defines_comment( parsed ):
+    if not parsed.define:
+        return ""
+    return "/* Generated for %s. */\n" % ", ".join( "%s=%d" % d for d in parsed.define )
+
+def output_cgetters( parsed, registers_list ):
+    license_lists = [registers.licenses for registers in registers_list]
+    # Assert every license list is the same
+    assert all(license_lists[0] == license_list for license_list in license_lists), \
+            "All XML files must have the same SPDX-License-Identifier"
+    with output_file( parsed.path + ".h" ) as fd_h, \
+            output_file( parsed.path + ".c" ) as fd_c:
         write_c_licenses( fd_h, license_lists[0] )
         if (parsed.create):
             fd_h.write(f"/* {parsed.create} */\n\n")
-        fd_h.write("#ifndef DEBUG_DEFINES_H\n#define DEBUG_DEFINES_H\n")
-        fd_c = open( parsed.path + ".c", "w" )
+        fd_h.write( defines_comment( parsed ) )
+        fd_h.write("#ifndef DEBUG_DEFINES_H\n#define DEBUG_DEFINES_H\n#include <stdint.h>\n")
         write_c_licenses( fd_c, license_lists[0] )
         if (parsed.create):
             fd_c.write(f"/* {parsed.create} */\n\n")
         fd_c.write(f'#include "{parsed.path}.h"\n#include <stddef.h>\n#include <assert.h>\n')
         for registers in registers_list:
             write_cheader( fd_h, registers )
-        print_cgetters(registers_list, fd_h, fd_c)
+        print_cgetters(registers_list, fd_h, fd_c, parsed.cfield_tables)
         fd_h.write("#endif\n")
-        return
 
-    registers = parse_xml( parsed.path )
-    if parsed.definitions:
-        write_definitions( open( parsed.definitions, "w" ), registers )
-    if parsed.cheader:
-        with open( parsed.cheader, "w" ) as fd:
-            write_c_licenses( fd, registers.licenses )
-            write_cheader( fd, registers )
-    if parsed.chisel:
-        write_chisel( open( parsed.chisel, "w" ), registers )
+def output_definitions( parsed, registers ):
+    with output_file( parsed.definitions ) as fd:
+        write_definitions( fd, registers )
+
+def output_cheader( parsed, registers ):
+    with output_file( parsed.cheader ) as fd:
+        write_c_licenses( fd, registers.licenses )
+        fd.write( defines_comment( parsed ) )
+        write_cheader( fd, registers )
+
+def output_chisel( parsed, registers ):
+    with output_file( parsed.chisel ) as fd:
+        write_chisel( fd, registers )
+
+def output_python( parsed, registers ):
+    with output_file( parsed.python ) as fd:
+        for license in registers.licenses:
+            fd.write( "# SPDX-License-Identifier: %s\n" % license )
+        if parsed.define:
+            fd.write( "# Generated for %s.\n" % ", ".join( "%s=%d" % d
+                for d in parsed.define ) )
+        write_python( fd, registers )
+
+def output_latex( parsed, registers ):
     if not registers.skip_index and not parsed.adoc:
         print_latex_index( registers )
     if parsed.register:
@@ -1125,19 +2959,518 @@ def main():
         print_latex_register( registers )
     if parsed.custom:
         print_latex_custom( registers )
+
+def output_adoc( parsed, registers ):
+    with output_file( parsed.adoc ) as fd:
+        fd.write(generated_comment( parsed, registers ))
+        if not registers.skip_index:
+            write_adoc_index( fd, registers )
+        write_adoc( fd, registers, fragment_cache( parsed.cache_dir ) )
+
+def output_adoc_definitions( parsed, registers ):
+    with output_file( parsed.adoc_definitions ) as fd:
+        fd.write(generated_comment( parsed, registers ))
+        write_adoc_definitions( fd, registers )
+
+def output_tasks( parsed ):
+    """Return the functions that write the outputs requested in parsed, in
+    the order they should run."""
+    tasks = []
+    if parsed.definitions:
+        tasks.append( output_definitions )
+    if parsed.cheader:
+        tasks.append( output_cheader )
+    if parsed.chisel:
+        tasks.append( output_chisel )
+    if parsed.python:
+        tasks.append( output_python )
+    if not parsed.stream or parsed.register or parsed.custom:
+        tasks.append( output_latex )
     if parsed.adoc:
-        with open( parsed.adoc, "w" ) as fd:
-            fd.write(f"// Auto-generated on {datetime.now()} from {parsed.path}\n")
-            if not registers.skip_index:
-                write_adoc_index( fd, registers )
-            write_adoc( fd, registers )
+        tasks.append( output_adoc )
     if parsed.adoc_definitions:
-        with open( parsed.adoc_definitions, "w" ) as fd:
-            fd.write(f"// Auto-generated on {datetime.now()} from {parsed.path}\n")
-            write_adoc_definitions( fd, registers )
+        tasks.append( output_adoc_definitions )
+    return tasks
+
+def stream_problem( parsed ):
+    """Return why the outputs requested in parsed can't be written with
+    --stream, or None if they can. Only outputs that look at one register
+    at a time can be streamed."""
+    options = [ option for option, value in (
+            ( "--cgetters", parsed.xml_paths ),
+            ( "--python", parsed.python ),
+            ( "--chisel", parsed.chisel ),
+            ( "--register", parsed.register ),
+            ( "--custom", parsed.custom ),
+            ( "--check-addresses", parsed.check_addresses ) ) if value ]
+    if options:
+        return "--stream can't be used with %s" % ", ".join( options )
+    if parsed.adoc:
+        # The index at the top of the AsciiDoc needs every register, unless
+        # the file asks for no index.
+        for _, root in xml.etree.ElementTree.iterparse( parsed.path,
+                events=( "start", ) ):
+            if not int( root.get( 'skip_index', 0 ) ):
+                return "--stream can't be used with --adoc for %s, which has " \
+                        "a register index" % parsed.path
+            break
+    return None
+
+def generate( parsed, load=parse_xml ):
+    """Write all the outputs requested in parsed, using load() to get the
+    Registers for a path."""
+    if (parsed.xml_paths):
+        registers_list = [specialized( parsed, load( xml_path ) )
+                for xml_path in parsed.xml_paths]
+        if parsed.check_addresses:
+            report_duplicate_addresses( registers_list )
+        with stats.timer( output_cgetters.__name__ ):
+            output_cgetters( parsed, registers_list )
+        return
+
+    if parsed.stream:
+        # Every output reads the file again, so that no more than one
+        # register is held at a time.
+        for task in output_tasks( parsed ):
+            with stats.timer( task.__name__ ):
+                task( parsed, specialized( parsed, stream_xml( parsed.path ) ) )
+        return
+
+    registers = specialized( parsed, load( parsed.path ) )
+    if parsed.check_addresses:
+        report_duplicate_addresses( [ registers ] )
+    for task in output_tasks( parsed ):
+        with stats.timer( task.__name__ ):
+            task( parsed, registers )
 
     #sed_convert(registers)
 
+def report_duplicate_addresses( registers_list ):
+    """Print every address used by more than one register to stderr."""
+    for space, address, registers in AddressIndex( registers_list ).duplicates():
+        print( "%s address %s is used by %s" % ( space, address,
+            ", ".join( r.short or r.name for r in registers ) ), file=sys.stderr )
+
+def capture_stdout( function, *args ):
+    """Call function, and return whatever it printed."""
+    output = io.StringIO()
+    with contextlib.redirect_stdout( output ):
+        function( *args )
+    return output.getvalue()
+
+def run_task( name, function, *args ):
+    """Run function( *args ) in a worker process, timed as name. Return
+    what it returned, what it printed, and the stats it collected."""
+    stats.reset()
+    output = io.StringIO()
+    with stats.timer( name ), contextlib.redirect_stdout( output ):
+        result = function( *args )
+    return result, output.getvalue(), stats.snapshot()
+
+def generate_group( invocations, load=parse_xml ):
+    """Call generate() for each of invocations in this process, loading each
+    XML file once. Return what each of them printed."""
+    store = ModelStore( load )
+    return [ capture_stdout( generate, parsed, store ) for parsed in invocations ]
+
+def generate_parallel( invocations, jobs, load=parse_xml ):
+    """Like calling generate() on each of invocations in turn, but on a pool
+    of jobs processes. Invocations that read the same XML files are run
+    together in one worker, which parses the files and writes the outputs,
+    so models never have to be sent between processes. Anything printed is
+    written to stdout in the same order as a serial run would."""
+    import concurrent.futures
+
+    groups = collections.OrderedDict()
+    for index, parsed in enumerate( invocations ):
+        key = tuple( sorted( set( os.path.realpath( p )
+            for p in invocation_paths( parsed ) ) ) )
+        groups.setdefault( key, [] ).append( index )
+
+    outputs = [ None ] * len( invocations )
+    with concurrent.futures.ProcessPoolExecutor( jobs ) as pool:
+        futures = { pool.submit( run_task, generate_group.__name__,
+            generate_group, [ invocations[i] for i in indexes ], load ): indexes
+            for indexes in groups.values() }
+        for future in concurrent.futures.as_completed( futures ):
+            printed, _, snapshot = future.result()
+            for index, output in zip( futures[future], printed ):
+                outputs[index] = output
+            stats.merge( snapshot )
+    for output in outputs:
+        sys.stdout.write( output )
+
+def read_manifest( path ):
+    """Return the argument lists contained in a batch manifest."""
+    if path == "-":
+        lines = sys.stdin.read().splitlines()
+    else:
+        with open( path ) as f:
+            lines = f.read().splitlines()
+    return [shlex.split( line ) for line in lines
+            if line.strip() and not line.lstrip().startswith( "#" )]
+
+def read_invocations( parser, manifests, cache_dir=None ):
+    """Return the parsed arguments for every invocation listed in
+    manifests."""
+    invocations = []
+    for manifest in manifests:
+        for args in read_manifest( manifest ):
+            parsed = parser.parse_args( args )
+            parsed.cache_dir = parsed.cache_dir or cache_dir
+            if parsed.batch:
+                parser.error( "--batch can't be nested in a manifest" )
+            if parsed.path is None:
+                parser.error( "Missing path in manifest line: %s" % " ".join( args ) )
+            invocations.append( parsed )
+    return invocations
+
+class ModelStore( object ):
+    """Registers for each XML file, loaded at most once until forget() is
+    called."""
+    def __init__( self, load=parse_xml ):
+        self.load = load
+        self.models = {}
+
+    def __call__( self, path ):
+        key = os.path.realpath( path )
+        if key not in self.models:
+            with stats.timer( "load" ):
+                self.models[key] = self.load( path )
+        return self.models[key]
+
+    def forget( self, path ):
+        self.models.pop( os.path.realpath( path ), None )
+
+def run_invocations( invocations, jobs, load=parse_xml ):
+    """Call generate() for every invocation, parsing each XML file once."""
+    if jobs != 1:
+        generate_parallel( invocations, jobs, load )
+        return
+
+    store = ModelStore( load )
+    for parsed in invocations:
+        generate( parsed, store )
+
+class Watcher( object ):
+    """Wait for any of a set of files to change. This uses inotify where it's
+    available, and polls otherwise."""
+    # IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE
+    INOTIFY_MASK = 0x2 | 0x4 | 0x8 | 0x80 | 0x100
+
+    def __init__( self, paths, interval ):
+        self.paths = sorted( set( os.path.realpath( p ) for p in paths ) )
+        self.interval = interval
+        self.signatures = { p: self.signature( p ) for p in self.paths }
+        self.inotify = self.open_inotify()
+
+    @staticmethod
+    def signature( path ):
+        try:
+            st = os.stat( path )
+        except FileNotFoundError:
+            return None
+        return ( st.st_mtime_ns, st.st_size, st.st_ino )
+
+    def open_inotify( self ):
+        try:
+            import ctypes
+            import ctypes.util
+            libc = ctypes.CDLL( ctypes.util.find_library( "c" ), use_errno=True )
+            fd = libc.inotify_init1( os.O_NONBLOCK | os.O_CLOEXEC )
+        except (AttributeError, ImportError, OSError, TypeError):
+            return None
+        if fd < 0:
+            return None
+        # Watch directories rather than files, so that editors which save by
+        # renaming a new file over the old one are noticed too.
+        for directory in set( os.path.dirname( p ) for p in self.paths ):
+            if libc.inotify_add_watch( fd, directory.encode(),
+                    self.INOTIFY_MASK ) < 0:
+                os.close( fd )
+                return None
+        return fd
+
+    def wait( self ):
+        """Block until at least one file has changed, and return the list of
+        changed files."""
+        while True:
+            if self.inotify is None:
+                time.sleep( self.interval )
+            else:
+                select.select( [self.inotify], [], [] )
+                # Let the editor finish writing, then drain the events. We
+                # only use them as a wakeup; the signatures tell us what
+                # changed.
+                time.sleep( self.interval )
+                try:
+                    while os.read( self.inotify, 65536 ):
+                        pass
+                except BlockingIOError:
+                    pass
+            changed = []
+            for path in self.paths:
+                signature = self.signature( path )
+                # A missing file is probably in the middle of being saved.
+                if signature is not None and signature != self.signatures[path]:
+                    self.signatures[path] = signature
+                    changed.append( path )
+            if changed:
+                return changed
+
+def invocation_paths( parsed ):
+    return parsed.xml_paths or [parsed.path]
+
+def watch( invocations, load=parse_xml, interval=0.1 ):
+    """Generate everything for invocations, and then keep regenerating the
+    outputs that depend on any XML file that changes. Models and rendered
+    register fragments stay in memory between changes."""
+    store = ModelStore( load )
+    for parsed in invocations:
+        generate( parsed, store )
+
+    paths = [p for parsed in invocations for p in invocation_paths( parsed )]
+    watcher = Watcher( paths, interval )
+    print( "Watching %d files%s." % ( len( watcher.paths ),
+        "" if watcher.inotify is not None else " (polling)" ), file=sys.stderr )
+    while True:
+        changed = watcher.wait()
+        start = time.perf_counter()
+        for path in changed:
+            store.forget( path )
+        failed = False
+        for parsed in invocations:
+            if not any( os.path.realpath( p ) in changed
+                    for p in invocation_paths( parsed ) ):
+                continue
+            try:
+                generate( parsed, store )
+            except Exception:
+                traceback.print_exc()
+                failed = True
+        if failed:
+            print( "Failed to regenerate from %s; some outputs are out of date." %
+                    ", ".join( changed ), file=sys.stderr )
+        else:
+            print( "Regenerated from %s in %.0f ms." % ( ", ".join( changed ),
+                ( time.perf_counter() - start ) * 1000 ), file=sys.stderr )
+
+# A DMI scan as OpenOCD logs it, e.g.
+# "41b w 00000001 @10 -> + 00000000 @00; 0i": the op, data and address sent,
+# then the status, data and address captured. What's captured is the result of
+# the previous scan's op.
+DMI_SCAN = re.compile( r"\b\d+b\s+([-rw?])\s+([0-9a-fA-F]+)\s*@\s*([0-9a-fA-F]+)"
+        r"\s*->\s*([-+?Fb])\s+([0-9a-fA-F]+)\s*@\s*([0-9a-fA-F]+)" )
+DMI_OPS = { "r": "read", "w": "write" }
+DMI_STATUS = { "+": "success", "F": "failed", "b": "busy" }
+LOG_COLUMNS = ( "line", "access", "status", "address", "register", "value",
+        "fields" )
+LOG_CHUNK_SIZE = 1 << 20
+
+class DmiLogDecoder( object ):
+    """Turns DMI scans logged by OpenOCD into one record per read or write,
+    with the fields of the value and the names of their values. The
+    registers are looked up by address, and their fields are kept as plain
+    tuples so the decoder is cheap to send to worker processes."""
+    def __init__( self, registers ):
+        # address -> ( register label, [( field, lsb, mask, { value: name } )] )
+        self.registers = {}
+        index = registers.address_index()
+        for space, addresses in index.spaces.items():
+            for key, found in addresses.items():
+                if key[0] != 0 or key[1] in self.registers:
+                    continue
+                r = found[0]
+                fields = []
+                for f in r.fields:
+                    if not f.define or not f.lsb.is_constant() or \
+                            not f.length().is_constant():
+                        continue
+                    fields.append(( f.name, int( f.lsb ),
+                        2 ** int( f.length() ) - 1, dict( f.c_named_values() ) ))
+                self.registers[key[1]] = ( r.label, fields )
+
+    def record( self, line, op, address, value, status ):
+        """Return the record for one scan. value and status are None when the
+        log doesn't show them."""
+        label, fields = self.registers.get( address, ( None, () ) )
+        record = { "line": line, "access": DMI_OPS[op], "status": status,
+                "address": "%#x" % address, "register": label,
+                "value": None if value is None else "%#010x" % value,
+                "fields": {}, "names": {} }
+        if value is None:
+            return record
+        for name, lsb, mask, names in fields:
+            field_value = ( value >> lsb ) & mask
+            record["fields"][name] = field_value
+            if field_value in names:
+                record["names"][name] = names[field_value]
+        return record
+
+    def decode( self, text, first_line, context=None, last=False ):
+        """Return the records for the scans in text, whose first line is line
+        number first_line. context is ( line number, line ) of the last scan
+        before text, if any. If last, also return a record for the last
+        scan, whose status (and value, for a read) is never logged."""
+        pending = None
+        if context:
+            match = DMI_SCAN.search( context[1] )
+            pending = ( context[0], match.group( 1 ), int( match.group( 2 ), 16 ),
+                    int( match.group( 3 ), 16 ) )
+        records = []
+        for number, line in enumerate( text.splitlines(), first_line ):
+            match = "->" in line and DMI_SCAN.search( line )
+            if not match:
+                continue
+            op, data, address, status, in_data, in_address = match.groups()
+            if pending and pending[1] in DMI_OPS:
+                value = int( in_data, 16 ) if pending[1] == "r" else pending[2]
+                records.append( self.record( pending[0], pending[1], pending[3],
+                    value, DMI_STATUS.get( status, status ) ) )
+            pending = ( number, op, int( data, 16 ), int( address, 16 ) )
+        if last and pending and pending[1] in DMI_OPS:
+            value = None if pending[1] == "r" else pending[2]
+            records.append( self.record( pending[0], pending[1], pending[3],
+                value, None ) )
+        return records
+
+def format_log_records( records, log_format ):
+    """Return records as JSON lines, or as CSV rows without a header."""
+    output = io.StringIO()
+    if log_format == "jsonl":
+        for record in records:
+            output.write( json.dumps( record ) + "\n" )
+        return output.getvalue()
+    writer = csv.writer( output, lineterminator="\n" )
+    for record in records:
+        fields = " ".join( "%s=%s" % ( name, record["names"].get( name, value ) )
+                for name, value in record["fields"].items() )
+        writer.writerow( [ record[c] for c in LOG_COLUMNS[:-1] ] + [ fields ] )
+    return output.getvalue()
+
+def decode_log_chunk( decoder, log_format, text, first_line, context, last ):
+    return format_log_records( decoder.decode( text, first_line, context, last ),
+            log_format )
+
+def last_dmi_scan( text, first_line ):
+    """Return ( line number, line ) of the last DMI scan in text, or None."""
+    end = len( text )
+    while True:
+        arrow = text.rfind( "->", 0, end )
+        if arrow < 0:
+            return None
+        start = text.rfind( "\n", 0, arrow ) + 1
+        stop = text.find( "\n", arrow )
+        line = text[start:stop if stop >= 0 else len( text )]
+        if DMI_SCAN.search( line ):
+            return first_line + text.count( "\n", 0, start ), line
+        end = start
+
+def log_chunks( f ):
+    """Yield ( text, first line number, context, last ) for chunks of about
+    LOG_CHUNK_SIZE characters of f, split between lines. context is what
+    DmiLogDecoder.decode() needs to know about the chunks before."""
+    first_line = 1
+    context = None
+    text = f.read( LOG_CHUNK_SIZE ) + f.readline()
+    while text:
+        following = f.read( LOG_CHUNK_SIZE ) + f.readline()
+        yield text, first_line, context, not following
+        context = last_dmi_scan( text, first_line ) or context
+        first_line += text.count( "\n" )
+        text = following
+
+def decode_log( parsed, registers, jobs ):
+    """Write the DMI transactions in the log named by parsed.decode_log as
+    JSON lines or CSV, in order. Chunks of the log are decoded on a pool of
+    jobs processes, with only a few of them in memory at a time."""
+    decoder = DmiLogDecoder( registers )
+    decode_chunk = functools.partial( decode_log_chunk, decoder,
+            parsed.log_format )
+    with contextlib.ExitStack() as stack:
+        if parsed.decode_log == "-":
+            log = sys.stdin
+        else:
+            log = stack.enter_context( open( parsed.decode_log,
+                errors="replace" ) )
+        if parsed.log_output:
+            out = stack.enter_context( open( parsed.log_output, "w",
+                newline="" ) )
+        else:
+            out = sys.stdout
+        if parsed.log_format == "csv":
+            csv.writer( out, lineterminator="\n" ).writerow( LOG_COLUMNS )
+        if jobs == 1:
+            for chunk in log_chunks( log ):
+                out.write( decode_chunk( *chunk ) )
+            return
+        import concurrent.futures
+        pool = stack.enter_context(
+                concurrent.futures.ProcessPoolExecutor( jobs ) )
+        pending = collections.deque()
+        for chunk in log_chunks( log ):
+            if len( pending ) >= 2 * jobs:
+                out.write( pending.popleft().result() )
+            pending.append( pool.submit( decode_chunk, *chunk ) )
+        while pending:
+            out.write( pending.popleft().result() )
+
+def main():
+    parser = argument_parser()
+    parsed = parser.parse_args()
+    start = time.perf_counter()
+    profile = None
+    if parsed.profile:
+        import cProfile
+        profile = cProfile.Profile()
+        profile.enable()
+    try:
+        run( parser, parsed )
+    finally:
+        if profile:
+            profile.disable()
+            profile.dump_stats( parsed.profile )
+        if parsed.stats_json:
+            result = { "wall_seconds": round( time.perf_counter() - start, 6 ) }
+            result.update( stats.to_json() )
+            with open( parsed.stats_json, "w" ) as f:
+                json.dump( result, f, indent=2 )
+                f.write( "\n" )
+
+def run( parser, parsed ):
+    """Do everything the command line arguments in parsed ask for."""
+    jobs = parsed.jobs or os.cpu_count()
+    if parsed.cache_dir:
+        load = functools.partial( load_cached, cache_dir=parsed.cache_dir )
+    else:
+        load = parse_xml
+
+    if parsed.decode_log:
+        if parsed.path is None:
+            parser.error( "--decode-log needs the path of the register XML" )
+        with stats.timer( decode_log.__name__ ):
+            decode_log( parsed, specialized( parsed, load( parsed.path ) ), jobs )
+        return
+
+    if parsed.batch:
+        invocations = read_invocations( parser, parsed.batch, parsed.cache_dir )
+    elif parsed.path is None:
+        parser.error( "the following arguments are required: path" )
+    else:
+        invocations = [parsed]
+    for invocation in invocations:
+        problem = invocation.stream and stream_problem( invocation )
+        if problem:
+            parser.error( problem )
+
+    if parsed.watch:
+        try:
+            watch( invocations, load, parsed.watch_interval )
+        except KeyboardInterrupt:
+            pass
+        return
+    run_invocations( invocations, jobs, load )
+
 def sed_convert( registers ):
     for r in registers.registers:
         regid = r.short or r.label
@@ -1151,4 +3484,5 @@ def sed_convert( registers ):
                 adoc = "{" + toAdocIdentifier( regid, f.name ) + "}"
                 print(f"s/{latex}/{adoc}/g")
 
-sys.exit( main() )
+if __name__ == "__main__":
+    sys.exit( main() )